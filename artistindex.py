@@ -0,0 +1,232 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from bisect import bisect_right
+from collections import OrderedDict
+import os
+import random
+import sqlite3
+import time
+
+import walker
+
+
+DEFAULT_PATH = '~/.cache/play/artists.sqlite'
+KEEP_LOADED = 8  # artists whose loaded songs are kept in memory
+WEIGHTS = ('size', 'age')
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return -1.0
+
+
+class Artist(object):
+    # top-level directory of music collection and what is known of it
+    def __init__(self, path, tracks=None, duration=None, scanned=None,
+                 played=None):
+        self.path = path
+        self.tracks = tracks      # None when not scanned yet
+        self.duration = duration  # secs
+        self.scanned = scanned    # time of last scan
+        self.played = played      # time when it was last picked
+
+
+class ArtistIndex(object):
+    # Index of artists (top-level directories) of music_dirs kept in
+    # memory and in sqlite file, so picking one needs neither listdir
+    # of music dir nor isdir of its entries - both are done only when
+    # the music dir itself changed (its mtime).
+    #
+    # Directories of the same name in several music dirs (collection
+    # spread over disks) are one artist, pick() returns all of them.
+    #
+    # Songs loaded for recently picked artists are kept (see keep()
+    # and loaded()) and reused as long as none of their directories
+    # changed, so repicking them does not scan them again.
+    #
+    # music_dirs: roots of the collection
+    # path: sqlite file, None keeps the index in memory only
+    # weight: None picks artists uniformly, 'size' by number
+    #   of their tracks, 'age' by time since they were played
+    SCHEMA = ('CREATE TABLE IF NOT EXISTS artists ('
+              ' root TEXT, path TEXT PRIMARY KEY,'
+              ' tracks INTEGER, duration REAL,'
+              ' scanned REAL, played REAL)',
+              'CREATE TABLE IF NOT EXISTS roots ('
+              ' root TEXT PRIMARY KEY, mtime REAL)')
+
+    def __init__(self, music_dirs, path=DEFAULT_PATH, weight=None):
+        self.music_dirs = [os.path.normpath(walker.unicode_path(dir_))
+                           for dir_ in music_dirs]
+        self.weight = weight
+        self._artists = None  # music dir => {path => Artist}
+        self._root_mtimes = {}
+        self._loaded = OrderedDict()  # path => (dir mtimes, songs)
+        self._db = None
+        if path is not None:
+            path = os.path.expanduser(path)
+            cache_dir = os.path.dirname(path)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            self._db = sqlite3.connect(path)
+            for statement in self.SCHEMA:
+                self._db.execute(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def artists(self):
+        # list of Artist (directories), refreshed when music dir changed
+        if self._artists is None:
+            self._read()
+        artists = []
+        for music_dir in self.music_dirs:
+            mtime = _mtime(music_dir)
+            if mtime != self._root_mtimes.get(music_dir):
+                self._rescan(music_dir, mtime)
+            artists.extend(self._artists[music_dir].values())
+        return artists
+
+    def pick(self):
+        # paths of randomly chosen artist ([] when there are none),
+        # which is marked as played
+        groups = {}
+        for artist in self.artists():
+            groups.setdefault(
+                os.path.basename(artist.path), []).append(artist)
+        if not groups:
+            return []
+        groups = list(groups.values())
+        if self.weight is None:
+            group = random.choice(groups)
+        else:
+            cumulative = []
+            total = 0.0
+            for weight in self._weights(groups):
+                total += weight
+                cumulative.append(total)
+            group = groups[min(len(groups) - 1, bisect_right(
+                cumulative, random.random() * total))]
+        now = time.time()
+        for artist in group:
+            artist.played = now
+            self._store(artist)
+        return sorted(artist.path for artist in group)
+
+    def update(self, path, songs, scanned=True):
+        # songs of artist at path were loaded (scanned=False when they
+        # were not found by scanning, e.g. kept ones were reused)
+        if self._artists is None:
+            self._read()
+        artist = self._artists.get(os.path.dirname(path), {}).get(path)
+        if artist is None:
+            return
+        artist.tracks = len(songs)
+        artist.duration = sum(song.length or 0 for song in songs)
+        if scanned:
+            artist.scanned = time.time()
+        self._store(artist)
+
+    def keep(self, path, songs, dirs):
+        # keeps songs found in path (scanning dirs) for loaded()
+        self._loaded.pop(path, None)
+        self._loaded[path] = ([(dir_, _mtime(dir_)) for dir_ in dirs],
+                              tuple(songs))
+        while len(self._loaded) > KEEP_LOADED:
+            self._loaded.popitem(last=False)
+
+    def loaded(self, path):
+        # songs kept for path, None when there are none or any of its
+        # directories changed since
+        kept = self._loaded.get(path)
+        if kept is None:
+            return None
+        (dir_mtimes, songs) = kept
+        for (dir_, mtime) in dir_mtimes:
+            if _mtime(dir_) != mtime:
+                del self._loaded[path]
+                return None
+        return list(songs)
+
+    def flush(self):
+        if self._db is not None:
+            self._db.commit()
+
+    def close(self):
+        if self._db is None:
+            return
+        self._db.commit()
+        self._db.close()
+        self._db = None
+
+    def _weights(self, groups):
+        if self.weight == 'size':
+            tracks = [sum(a.tracks or 0 for a in group) for group in groups]
+            known = [count for count in tracks if count]
+            # (not yet scanned ones are taken as average)
+            average = float(sum(known)) / len(known) if known else 1.0
+            return [count or average for count in tracks]
+        # age: never played ones as if played before the oldest one
+        now = time.time()
+        played = [max(a.played for a in group) for group in groups]
+        oldest = min([when for when in played if when] or [now])
+        return [now - (when or oldest - 86400) + 1 for when in played]
+
+    def _read(self):
+        self._artists = dict((music_dir, {}) for music_dir in self.music_dirs)
+        if self._db is None:
+            return
+        for music_dir in self.music_dirs:
+            for row in self._db.execute(
+                    'SELECT path, tracks, duration, scanned, played'
+                    ' FROM artists WHERE root = ?', (music_dir,)):
+                self._artists[music_dir][row[0]] = Artist(*row)
+            row = self._db.execute('SELECT mtime FROM roots WHERE root = ?',
+                                   (music_dir,)).fetchone()
+            if row is not None:
+                self._root_mtimes[music_dir] = row[0]
+
+    def _rescan(self, music_dir, mtime):
+        artists = self._artists[music_dir]
+        found = set()
+        try:
+            subs = os.listdir(music_dir)
+        except OSError:
+            subs = []  # (e.g. unplugged disk)
+        for sub in subs:
+            path = os.path.join(music_dir, sub)
+            if os.path.isdir(path):
+                found.add(path)
+        for path in list(artists):
+            if path not in found:
+                del artists[path]
+        for path in found:
+            if path not in artists:
+                artists[path] = Artist(path)
+        self._root_mtimes[music_dir] = mtime
+        if self._db is None:
+            return
+        self._db.execute('DELETE FROM artists WHERE root = ?', (music_dir,))
+        self._db.executemany(
+            'INSERT OR REPLACE INTO artists VALUES (?, ?, ?, ?, ?, ?)',
+            [self._row(artist) for artist in artists.values()])
+        self._db.execute('INSERT OR REPLACE INTO roots VALUES (?, ?)',
+                         (music_dir, mtime))
+        self._db.commit()
+
+    def _row(self, artist):
+        return (os.path.dirname(artist.path), artist.path, artist.tracks,
+                artist.duration, artist.scanned, artist.played)
+
+    def _store(self, artist):
+        if self._db is not None:
+            self._db.execute(
+                'INSERT OR REPLACE INTO artists VALUES (?, ?, ?, ?, ?, ?)',
+                self._row(artist))
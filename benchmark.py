@@ -0,0 +1,357 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+"""benchmark.py [-h|--help] [-s|--sizes N,N,...] [-d|--depth N]
+ [-f|--formats ogg,mp3,flac] [-w|--workdir DIR] [-o|--output FILE]
+ [-c|--compare OLD.json NEW.json]
+
+Times song lookup, tag loading, shuffle/sort, search and list_songs
+of play2.py on generated music trees of given sizes (each size measured
+in separate process, so peak memory is its own). Results are written
+as JSON (to stdout by default), two of them can be compared by -c."""
+from __future__ import print_function, unicode_literals
+import io
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from mutagen.ogg import OggPage
+
+# --- default configuration ------
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_DEPTH = 2  # artist/album
+DEFAULT_FORMATS = ('ogg', 'mp3', 'flac')
+SONGS_PER_DIR = 10
+SONG_LENGTH = 200  # secs (as written in headers)
+QUERIES = 5  # searches typed (key by key) per size
+SEED = 42
+# --- end default configuration --
+
+
+def usage(code, msg=''):
+    if msg:
+        print("** Error: ", msg)
+    print(__doc__)
+    sys.exit(code)
+
+
+def get_opts(args):
+    opts = {
+        'sizes': DEFAULT_SIZES,
+        'depth': DEFAULT_DEPTH,
+        'formats': DEFAULT_FORMATS,
+        'workdir': None,
+        'output': None,
+        'compare': None,
+        'run': None,
+    }
+    args = iter(args[1:])
+    for opt in args:
+        try:
+            if opt == '-h' or opt == '--help':
+                usage(0)
+            elif opt == '-s' or opt == '--sizes':
+                opts['sizes'] = tuple(int(n) for n in next(args).split(','))
+            elif opt == '-d' or opt == '--depth':
+                opts['depth'] = int(next(args))
+            elif opt == '-f' or opt == '--formats':
+                opts['formats'] = tuple(next(args).split(','))
+            elif opt == '-w' or opt == '--workdir':
+                opts['workdir'] = next(args)
+            elif opt == '-o' or opt == '--output':
+                opts['output'] = next(args)
+            elif opt == '-c' or opt == '--compare':
+                opts['compare'] = (next(args), next(args))
+            elif opt == '--run':  # (internal) measure one tree
+                opts['run'] = next(args)
+            else:
+                usage(1, 'Unknown option %s' % opt)
+        except (StopIteration, ValueError):
+            usage(1, 'Option %s requires a value' % opt)
+    for fmt in opts['formats']:
+        if fmt not in WRITERS:
+            usage(1, 'Unknown format %s' % fmt)
+    return opts
+
+
+# --- synthetic songs ------------
+# smallest files mutagen reads with tags and length,
+# audio data itself is not valid (nothing is going to play them)
+
+def _vorbis_comment(tags):
+    data = [struct.pack('<I', 9), b'benchmark', struct.pack('<I', len(tags))]
+    for (key, value) in tags:
+        comment = ('%s=%s' % (key.upper(), value)).encode('utf-8')
+        data.append(struct.pack('<I', len(comment)))
+        data.append(comment)
+    return b''.join(data)
+
+
+def ogg_song(tags, length=SONG_LENGTH, rate=44100):
+    ident = (b'\x01vorbis' +
+             struct.pack('<IBIiiiBB', 0, 2, rate, 0, 128000, 0, 0xb8, 1))
+    comment = b'\x03vorbis' + _vorbis_comment(tags) + b'\x01'
+    setup = b'\x05vorbis' + b'\0' * 32
+    pages = []
+    for (seq, packets, position) in ((0, [ident], 0),
+                                     (1, [comment, setup], 0),
+                                     (2, [b'\0' * 64], length * rate)):
+        page = OggPage()
+        page.serial = 1
+        page.sequence = seq
+        page.position = position
+        page.packets = packets
+        page.first = seq == 0
+        page.last = seq == 2
+        pages.append(page.write())
+    return b''.join(pages)
+
+
+def _syncsafe(num):
+    return struct.pack('>4B', (num >> 21) & 0x7f, (num >> 14) & 0x7f,
+                       (num >> 7) & 0x7f, num & 0x7f)
+
+
+def mp3_song(tags, frames=8):
+    # ID3v2.4 tag + MPEG-1 layer III frames (128kbps, 44.1kHz)
+    ids = {'title': b'TIT2', 'artist': b'TPE1', 'album': b'TALB'}
+    frame_data = []
+    for (key, value) in tags:
+        text = b'\x03' + value.encode('utf-8')  # utf-8 encoded
+        frame_data.append(ids[key] + _syncsafe(len(text)) + b'\0\0' + text)
+    frame_data = b''.join(frame_data)
+    header = b'ID3\x04\x00\x00' + _syncsafe(len(frame_data))
+    audio = (b'\xff\xfb\x90\x00' + b'\0' * 413) * frames
+    return header + frame_data + audio
+
+
+def flac_song(tags, length=SONG_LENGTH, rate=44100):
+    samples = length * rate
+    streaminfo = struct.pack(
+        '>HH3s3sQ16s', 4096, 4096, b'\0\0\0', b'\0\0\0',
+        # rate (20 bits), channels-1 (3), bits-1 (5), samples (36)
+        (rate << 44) | (1 << 41) | (15 << 36) | samples,
+        b'\0' * 16)
+    comment = _vorbis_comment(tags)
+    return b''.join((
+        b'fLaC',
+        b'\x00' + struct.pack('>I', len(streaminfo))[1:], streaminfo,
+        b'\x84' + struct.pack('>I', len(comment))[1:], comment))
+
+
+WRITERS = {'ogg': ogg_song, 'mp3': mp3_song, 'flac': flac_song}
+
+
+def generate(root, count, depth=DEFAULT_DEPTH, formats=DEFAULT_FORMATS):
+    # count songs in tree depth dirs deep (artist/album/...),
+    # SONGS_PER_DIR songs in each leaf directory
+    # returns list of song paths
+    leaves = int(math.ceil(count / float(SONGS_PER_DIR)))
+    fanout = max(2, int(math.ceil(leaves ** (1.0 / depth))))
+    names = ('Artist', 'Album') + ('Disc',) * max(0, depth - 2)
+    songs = []
+    for idx in range(count):
+        leaf = idx // SONGS_PER_DIR
+        parts = []
+        for level in range(depth):
+            num = leaf // (fanout ** (depth - level - 1)) % fanout
+            parts.append('%s %03d' % (names[level], num))
+        dir_ = os.path.join(root, *parts)
+        if idx % SONGS_PER_DIR == 0 and not os.path.isdir(dir_):
+            os.makedirs(dir_)
+        fmt = formats[idx % len(formats)]
+        title = 'Song %d of %s' % (idx % SONGS_PER_DIR + 1, parts[-1])
+        tags = [('title', title), ('artist', parts[0]),
+                ('album', parts[min(1, depth - 1)])]
+        path = os.path.join(
+            dir_, '%02d %s.%s' % (idx % SONGS_PER_DIR + 1, title, fmt))
+        with open(path, 'wb') as song_file:
+            song_file.write(WRITERS[fmt](tags))
+        songs.append(path)
+    return songs
+
+
+def ensure_tree(workdir, count, depth, formats):
+    # generated tree is reused by later runs with same parameters
+    root = os.path.join(workdir, 'songs-%d-d%d-%s' % (
+        count, depth, '-'.join(formats)))
+    done = os.path.join(root, '.complete')
+    if not os.path.exists(done):
+        if os.path.isdir(root):
+            shutil.rmtree(root)
+        start = time.time()
+        print('generating %d songs into %s' % (count, root), file=sys.stderr)
+        generate(root, count, depth, formats)
+        open(done, 'w').close()
+        print(' done in %.1fs' % (time.time() - start), file=sys.stderr)
+    return root
+
+
+# --- measurements ---------------
+
+def peak_rss():
+    # KiB (ru_maxrss is in bytes on macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+class Timer(object):
+    # collects secs (and peak rss after) of named phases
+    def __init__(self):
+        self.results = {}
+
+    def __call__(self, name, func, *args):
+        start = time.time()
+        value = func(*args)
+        self.results[name] = {
+            'secs': round(time.time() - start, 6),
+            'peak_rss_kib': peak_rss(),
+        }
+        return value
+
+
+def search_keystrokes(index, songs, count=QUERIES):
+    # types searches for (random) songs' artist and title key by key,
+    # returns secs of each key
+    rnd = random.Random(SEED)
+    secs = []
+    for song in rnd.sample(songs, min(count, len(songs))):
+        query = ('%s %s' % (song.artist, song.title)).lower()
+        for end in range(1, len(query) + 1):
+            start = time.time()
+            index.search(query[:end], 10)
+            secs.append(time.time() - start)
+    return secs
+
+
+def measure(root):
+    # runs in its own process (see run_size)
+    import play2
+    import searchindex
+    import walker
+
+    timer = Timer()
+    baseline = peak_rss()
+    found = timer('discover', walker.SongWalker(
+        play2.SONG_EXTENSIONS, play2.IGNORED_NAMES).find_songs, root)
+    records = timer('load_tags', lambda: [
+        (path, play2.read_record(path)) for path in found])
+    songs = timer('songinfo', lambda: [
+        play2.SongInfo(path, record=record) for (path, record) in records])
+    rnd = random.Random(SEED)
+    timer('shuffle', rnd.shuffle, list(songs))
+    timer('sort', sorted, songs)
+    index = searchindex.SearchIndex(songs)
+    timer('search_index', index.build)
+    keys = search_keystrokes(index, songs)
+    keys.sort()
+
+    player = play2.Player.__new__(play2.Player)  # (no mplayer needed)
+    player._songs = songs
+    player._current = len(songs) // 2
+    stdout = sys.stdout
+    sys.stdout = io.open(os.devnull, 'w', encoding='utf-8')
+    try:
+        timer('list_songs', player.list_songs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    return {
+        'songs': len(songs),
+        'unreadable': sum(1 for (_, r) in records if r[3] is None),
+        'phases': timer.results,
+        'search_keystroke': {
+            'keys': len(keys),
+            'mean': sum(keys) / len(keys) if keys else None,
+            'median': keys[len(keys) // 2] if keys else None,
+            'max': keys[-1] if keys else None,
+        },
+        'baseline_rss_kib': baseline,
+        'peak_rss_kib': peak_rss(),
+    }
+
+
+def run_size(count, opts, workdir):
+    root = ensure_tree(workdir, count, opts['depth'], opts['formats'])
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--run', root])
+    result = json.loads(output.decode('utf-8'))
+    result.update({
+        'size': count,
+        'depth': opts['depth'],
+        'formats': list(opts['formats']),
+    })
+    return result
+
+
+def compare(old_path, new_path):
+    with open(old_path) as old_file:
+        old = dict((r['size'], r) for r in json.load(old_file)['runs'])
+    with open(new_path) as new_file:
+        new = dict((r['size'], r) for r in json.load(new_file)['runs'])
+    for size in sorted(set(old) & set(new)):
+        print('%d songs:' % size)
+        rows = [(name, old[size]['phases'][name]['secs'],
+                 new[size]['phases'][name]['secs'])
+                for name in sorted(new[size]['phases'])
+                if name in old[size]['phases']]
+        rows.append(('search key (mean)',
+                     old[size]['search_keystroke']['mean'],
+                     new[size]['search_keystroke']['mean']))
+        for (name, before, after) in rows:
+            ratio = after / before if before else float('inf')
+            print('  %-18s %10.4fs %10.4fs  x%.2f' % (
+                name, before, after, ratio))
+        print('  %-18s %9dK %9dK' % (
+            'peak rss', old[size]['peak_rss_kib'],
+            new[size]['peak_rss_kib']))
+
+
+def main():
+    opts = get_opts(sys.argv)
+    if opts['run']:
+        print(json.dumps(measure(opts['run'])))
+        return
+    if opts['compare']:
+        compare(*opts['compare'])
+        return
+
+    workdir = opts['workdir']
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='play-benchmark-')
+    try:
+        runs = []
+        for count in opts['sizes']:
+            print('measuring %d songs' % count, file=sys.stderr)
+            runs.append(run_size(count, opts, workdir))
+    finally:
+        if opts['workdir'] is None:
+            shutil.rmtree(workdir)
+    results = json.dumps({
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': SEED,
+        'runs': runs,
+    }, indent=2, sort_keys=True)
+    if opts['output']:
+        with open(opts['output'], 'w') as out_file:
+            out_file.write(results)
+    else:
+        print(results)
+
+
+if __name__ == '__main__':
+    main()
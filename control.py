@@ -0,0 +1,185 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import errno
+import json
+import os
+import socket
+import sys
+import traceback
+
+DEFAULT_SOCKET = '~/.cache/play/control.sock'
+MAX_LINE = 65536  # longest command accepted
+
+
+class ControlError(Exception):
+    pass
+
+
+def socket_path(path=None):
+    return os.path.expanduser(path or DEFAULT_SOCKET)
+
+
+class ControlServer(object):
+    # Unix socket server running in eventloop.EventLoop - clients
+    # send one command per line, name optionally followed by space
+    # and argument (e.g. 'volume +5'), each one is answered by one
+    # line of JSON: {"ok": true, "result": ...}
+    # or {"ok": false, "error": "..."}
+    #
+    # commands: {name: callable(argument or None)} returning
+    #   result (anything JSON can encode), raising ControlError
+    #   (or ValueError) when the command can't be done - any other
+    #   exception is logged to stderr and answered as error too
+    # after_command: callable() called after each command
+    #   (e.g. to show its effect)
+    def __init__(self, loop, path, commands, after_command=None):
+        self.path = socket_path(path)
+        self._loop = loop
+        self._commands = commands
+        self._after_command = after_command
+        self._buffers = {}  # client socket => received data
+        self._sock = None
+
+    def start(self):
+        check_free(self.path)
+        if os.path.exists(self.path):
+            os.remove(self.path)  # left by previous (crashed) one
+        dir_ = os.path.dirname(self.path)
+        if dir_ and not os.path.isdir(dir_):
+            os.makedirs(dir_)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self._sock.listen(8)
+        self._loop.add_reader(self._sock, self._accept)
+
+    def close(self):
+        for client in list(self._buffers):
+            self._drop(client)
+        if self._sock is None:
+            return
+        self._loop.remove_reader(self._sock)
+        self._sock.close()
+        self._sock = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _accept(self):
+        try:
+            (client, _) = self._sock.accept()
+        except socket.error:
+            return
+        # (replies are short, sending them may block for a moment)
+        client.settimeout(1)
+        self._buffers[client] = b''
+        self._loop.add_reader(client, self._on_data, client)
+
+    def _drop(self, client):
+        self._loop.remove_reader(client)
+        del self._buffers[client]
+        client.close()
+
+    def _on_data(self, client):
+        try:
+            data = client.recv(4096)
+        except socket.error:
+            data = b''
+        if not data:
+            self._drop(client)
+            return
+        data = self._buffers[client] + data
+        lines = data.split(b'\n')
+        self._buffers[client] = lines.pop()
+        if len(self._buffers[client]) > MAX_LINE:
+            self._drop(client)
+            return
+        try:
+            for line in lines:
+                reply = self._run(line.decode('utf-8', 'replace').strip())
+                try:
+                    data = json.dumps(reply)
+                except (TypeError, ValueError) as exc:
+                    data = json.dumps({'ok': False, 'error': '%s' % exc})
+                client.sendall(data.encode('utf-8') + b'\n')
+        except socket.error:
+            self._drop(client)
+
+    def _run(self, line):
+        (name, _, argument) = line.partition(' ')
+        command = self._commands.get(name)
+        if command is None:
+            return {'ok': False, 'error': 'unknown command: %s' % name}
+        try:
+            result = command(argument or None)
+            if self._after_command is not None:
+                self._after_command()
+        except (ControlError, ValueError, TypeError) as exc:
+            return {'ok': False, 'error': '%s' % exc}
+        except Exception as exc:
+            # (unexpected - logged, but daemon goes on serving)
+            print('\r** Command %s failed:\n%s' % (
+                line, traceback.format_exc()), file=sys.stderr)
+            return {'ok': False, 'error': '%s failed: %s' % (name, exc)}
+        return {'ok': True, 'result': result}
+
+
+def check_free(path=None):
+    # raises ControlError when a server is listening on path already
+    path = socket_path(path)
+    if _is_listening(path):
+        raise ControlError('already running (%s)' % path)
+
+
+def _is_listening(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class ControlClient(object):
+    # connection to ControlServer, call() returns result of command
+    # or raises ControlError
+    def __init__(self, path=None, timeout=5):
+        self.path = socket_path(path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        try:
+            self._sock.connect(self.path)
+        except socket.error as exc:
+            self._sock.close()
+            if exc.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                raise ControlError('not running (%s)' % self.path)
+            raise
+        self._data = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def call(self, name, argument=None):
+        line = name if argument is None else '%s %s' % (name, argument)
+        self._sock.sendall(line.encode('utf-8') + b'\n')
+        while b'\n' not in self._data:
+            data = self._sock.recv(65536)
+            if not data:
+                raise ControlError('connection closed')
+            self._data += data
+        (reply, self._data) = self._data.split(b'\n', 1)
+        reply = json.loads(reply.decode('utf-8'))
+        if not reply['ok']:
+            raise ControlError(reply['error'])
+        return reply['result']
+
+    def close(self):
+        self._sock.close()
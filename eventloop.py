@@ -0,0 +1,191 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from collections import deque
+import errno
+import fcntl
+import heapq
+import itertools
+import os
+import select
+import signal
+import threading
+import time
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+
+def _fileno(fileobj):
+    if isinstance(fileobj, int):
+        return fileobj
+    return fileobj.fileno()
+
+
+def set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class Timer(object):
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop(object):
+    # Minimal single threaded event loop - readable file descriptors
+    # and timers, waiting is done in selectors (select.select on
+    # pythons without it) so nothing is polled while idle.
+    #
+    # Other threads can hand callbacks over by call_soon_threadsafe,
+    # which wakes the loop up through a self-pipe - so do signal
+    # handlers added by add_signal_handler (their callbacks run
+    # in the loop, not in the signal handler itself).
+    def __init__(self):
+        self._readers = {}     # fd => (callback, args)
+        self._timers = []      # heap of (when, seq, Timer)
+        self._seq = itertools.count()
+        self._ready = deque()  # callbacks from other threads
+        self._ready_lock = threading.Lock()
+        self._signals = {}     # signum => (callback, args)
+        self._caught = deque()  # signums caught, not handled yet
+        if selectors is not None:
+            self._selector = selectors.DefaultSelector()
+        else:
+            self._selector = None
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        set_nonblocking(self._wakeup_r)
+        set_nonblocking(self._wakeup_w)
+        self.add_reader(self._wakeup_r, self._drain_wakeup)
+
+    def close(self):
+        for signum in list(self._signals):
+            self.remove_signal_handler(signum)
+        self.remove_reader(self._wakeup_r)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        if self._selector is not None:
+            self._selector.close()
+
+    def add_reader(self, fileobj, callback, *args):
+        fd = _fileno(fileobj)
+        if fd in self._readers:
+            self.remove_reader(fd)
+        self._readers[fd] = (callback, args)
+        if self._selector is not None:
+            self._selector.register(fd, selectors.EVENT_READ)
+
+    def remove_reader(self, fileobj):
+        fd = _fileno(fileobj)
+        if self._readers.pop(fd, None) is None:
+            return False
+        if self._selector is not None:
+            self._selector.unregister(fd)
+        return True
+
+    def call_later(self, delay, callback, *args):
+        timer = Timer(time.time() + delay, callback, args)
+        heapq.heappush(self._timers, (timer.when, next(self._seq), timer))
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        with self._ready_lock:
+            self._ready.append((callback, args))
+        try:
+            os.write(self._wakeup_w, b'x')
+        except OSError as exc:
+            if exc.errno != errno.EAGAIN:
+                raise
+            # pipe is full, loop will wake up anyway
+
+    def add_signal_handler(self, signum, callback, *args):
+        # (main thread only, as signal.signal)
+        self._signals[signum] = (callback, args)
+        signal.signal(signum, self._on_signal)
+
+    def remove_signal_handler(self, signum):
+        if self._signals.pop(signum, None) is None:
+            return False
+        signal.signal(signum, signal.SIG_DFL)
+        return True
+
+    def _on_signal(self, signum, frame):
+        # no locks here - handler may interrupt code holding them
+        self._caught.append(signum)
+        try:
+            os.write(self._wakeup_w, b'x')
+        except OSError as exc:
+            if exc.errno != errno.EAGAIN:
+                raise
+
+    def run_once(self, timeout=None):
+        # waits (at most timeout secs, or till next timer) for events
+        # and runs their callbacks
+        timeout = self._timeout(timeout)
+        for fd in self._select(timeout):
+            if fd in self._readers:
+                (callback, args) = self._readers[fd]
+                callback(*args)
+        self._run_signals()
+        self._run_ready()
+        self._run_timers()
+
+    def _timeout(self, timeout):
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if self._ready or self._caught:
+            return 0
+        if self._timers:
+            until_timer = max(0, self._timers[0][0] - time.time())
+            if timeout is None or until_timer < timeout:
+                return until_timer
+        return timeout
+
+    def _select(self, timeout):
+        if self._selector is not None:
+            return [key.fd for (key, _) in self._selector.select(timeout)]
+        try:
+            readable, _, _ = select.select(
+                list(self._readers), [], [], timeout)
+        except select.error as exc:
+            if exc.args[0] != errno.EINTR:
+                raise
+            return []
+        return readable
+
+    def _run_ready(self):
+        with self._ready_lock:
+            ready = self._ready
+            self._ready = deque()
+        for (callback, args) in ready:
+            callback(*args)
+
+    def _run_signals(self):
+        while self._caught:
+            signum = self._caught.popleft()
+            if signum in self._signals:
+                (callback, args) = self._signals[signum]
+                callback(*args)
+
+    def _run_timers(self):
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            (_, _, timer) = heapq.heappop(self._timers)
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except OSError as exc:
+            if exc.errno != errno.EAGAIN:
+                raise
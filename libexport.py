@@ -0,0 +1,195 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+import os
+import re
+import struct
+import sys
+
+MAGIC = b'PLAYLIB\0'
+VERSION = 1
+CHUNK = 256 * 1024  # bytes read at once by iter_library
+
+# magic, version, number of songs
+HEADER = struct.Struct('<8sII')
+# per song: bytes of path shared with previous song's path, bytes
+# of rest of path, title, artist and album (all utf-8, following the
+# record), length (NaN when unknown) and bitrate (0 when unknown)
+RECORD = struct.Struct('<HHHHHdi')
+MAX_TEXT = 65535
+# playlist entries of streams (http://..., mms://...), not local files
+URL = re.compile(r'^[a-z][a-z0-9+.-]*://', re.IGNORECASE)
+
+
+def _text(value):
+    # utf-8 of value, cut to MAX_TEXT bytes on character boundary
+    encoded = (value or '').encode('utf-8')
+    if len(encoded) > MAX_TEXT:
+        encoded = encoded[:MAX_TEXT].decode('utf-8', 'ignore').encode(
+            'utf-8')
+    return encoded
+
+
+def _write_atomic(path, data):
+    # one write into temporary file renamed over path
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as out_file:
+        out_file.write(data)
+    os.rename(tmp_path, path)
+
+
+def write_library(path, songs):
+    # songs (SongInfo like objects) to binary library file,
+    # returns number of songs written
+    chunks = [b'']  # (header, when the count is known)
+    previous = b''
+    for song in songs:
+        encoded = song.path.encode('utf-8')
+        shared = min(len(os.path.commonprefix((previous, encoded))),
+                     MAX_TEXT)
+        rest = encoded[shared:]
+        texts = [_text(getattr(song, attr, None))
+                 for attr in ('title', 'artist', 'album')]
+        length = song.length
+        chunks.append(RECORD.pack(
+            shared, len(rest), len(texts[0]), len(texts[1]), len(texts[2]),
+            float('nan') if length is None else length,
+            song.bitrate or 0))
+        chunks.append(rest)
+        chunks.extend(texts)
+        previous = encoded
+    count = (len(chunks) - 1) // 5
+    chunks[0] = HEADER.pack(MAGIC, VERSION, count)
+    _write_atomic(path, b''.join(chunks))
+    return count
+
+
+def is_library(path):
+    try:
+        with open(path, 'rb') as lib_file:
+            return lib_file.read(len(MAGIC)) == MAGIC
+    except (IOError, OSError):
+        return False
+
+
+def iter_library(path):
+    # yields (path, record) of songs in binary library file, where
+    # record is (title, artist, album, length, bitrate) - file is read
+    # in chunks, so songs come before the whole file is read
+    with open(path, 'rb') as lib_file:
+        header = lib_file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError('not a library file: %s' % path)
+        (magic, version, count) = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a library file: %s' % path)
+        data = b''
+        pos = 0
+        previous = b''
+        for _ in range(count):
+            if len(data) - pos < RECORD.size:
+                (data, pos) = (data[pos:] + lib_file.read(CHUNK), 0)
+                if len(data) < RECORD.size:
+                    raise ValueError('truncated library file: %s' % path)
+            (shared, rest_len, title_len, artist_len, album_len, length,
+             bitrate) = RECORD.unpack_from(data, pos)
+            start = pos + RECORD.size
+            end = start + rest_len + title_len + artist_len + album_len
+            if len(data) < end:
+                (data, start, end) = (
+                    data[pos:] + lib_file.read(max(CHUNK, end - pos)),
+                    start - pos, end - pos)
+                if len(data) < end:
+                    raise ValueError('truncated library file: %s' % path)
+            encoded = previous[:shared] + data[start:start + rest_len]
+            start += rest_len
+            texts = []
+            for text_len in (title_len, artist_len, album_len):
+                texts.append(data[start:start + text_len].decode('utf-8'))
+                start += text_len
+            previous = encoded
+            pos = end
+            yield (encoded.decode('utf-8'), (
+                texts[0], texts[1], texts[2],
+                None if length != length else length,
+                bitrate))
+
+
+def write_m3u(path, songs):
+    lines = ['#EXTM3U']
+    for song in songs:
+        lines.append('#EXTINF:%d,%s' % (
+            round(song.length) if song.length else -1, song))
+        lines.append(song.path)
+    _write_atomic(path, ('\n'.join(lines) + '\n').encode('utf-8'))
+    return (len(lines) - 1) // 2
+
+
+def write_pls(path, songs):
+    lines = ['[playlist]']
+    count = 0
+    for song in songs:
+        count += 1
+        lines.append('File%d=%s' % (count, song.path))
+        lines.append('Title%d=%s' % (count, song))
+        lines.append('Length%d=%d' % (
+            count, round(song.length) if song.length else -1))
+    lines.append('NumberOfEntries=%d' % count)
+    lines.append('Version=2')
+    _write_atomic(path, ('\n'.join(lines) + '\n').encode('utf-8'))
+    return count
+
+
+def export(path, songs):
+    # writes songs by extension of path - M3U (.m3u, .m3u8),
+    # PLS (.pls) or binary library (anything else),
+    # returns number of songs written
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.m3u', '.m3u8'):
+        return write_m3u(path, songs)
+    if extension == '.pls':
+        return write_pls(path, songs)
+    return write_library(path, songs)
+
+
+def read_playlist(path):
+    # song paths of M3U, PLS or plain (one path per line) playlist,
+    # relative ones are taken as relative to playlist's directory
+    # (URLs of streams are kept as they are, see is_url)
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'rb') as playlist_file:
+        lines = playlist_file.read().decode('utf-8', 'replace').splitlines()
+    pls = lines and lines[0].strip().lower() == '[playlist]'
+    songs = []
+    for line in lines:
+        line = line.strip()
+        if pls:
+            (key, _, value) = line.partition('=')
+            if not key.lower().startswith('file'):
+                continue
+            line = value.strip()
+        elif line.startswith('#'):
+            continue
+        if line:
+            songs.append(line if is_url(line) else os.path.join(base, line))
+    return songs
+
+
+def is_url(path):
+    return URL.match(path) is not None
+
+
+def song_paths(path):
+    # paths of songs in library or playlist file
+    if is_library(path):
+        return [song_path for (song_path, _) in iter_library(path)]
+    return read_playlist(path)
+
+
+if __name__ == '__main__':
+    # prints songs of library (or playlist) file, path per line,
+    # as plain playlist for mplayer front ends (play.sh, play.pl)
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    for song_path in song_paths(sys.argv[1]):
+        out.write(song_path.encode('utf-8') + b'\n')
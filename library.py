@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from array import array
+import os
+import sys
+
+
+class Library(object):
+    # Compact (columnar) store of songs, alternative to one SongInfo
+    # object per song for big collections.
+    #
+    # Directories, artists and albums are interned (stored once,
+    # referenced by id), numbers are kept in arrays and texts
+    # for display/search are built only when asked for.
+    # Songs are accessed through SongView objects, which provide
+    # same interface as SongInfo.
+    #
+    # use_tags: like SongInfo's use_tags, when False tags are not kept
+    def __init__(self, use_tags=True):
+        self.use_tags = use_tags
+        self._names = ['']         # interned dirs, artists and albums
+        self._name_ids = {'': 0}
+        self._dirs = array('i')
+        self._files = []
+        self._titles = []
+        self._artists = array('i')
+        self._albums = array('i')
+        self._lengths = array('d')   # NaN when unknown
+        self._bitrates = array('i')  # 0 when unknown
+
+    # names of columns, see columns() - (text) sequences or arrays
+    COLUMNS = ('names', 'dirs', 'files', 'titles', 'artists', 'albums',
+               'lengths', 'bitrates')
+
+    @classmethod
+    def from_columns(cls, use_tags, columns):
+        # library of columns as returned by columns(), sequences of
+        # texts may be anything indexable with append() (e.g. mapped
+        # from file, see snapshot.py)
+        lib = cls(use_tags)
+        for name in cls.COLUMNS:
+            setattr(lib, '_' + name, columns[name])
+        lib._name_ids = dict(
+            (name, name_id) for (name_id, name) in enumerate(lib._names))
+        return lib
+
+    def columns(self):
+        return dict((name, getattr(self, '_' + name))
+                    for name in self.COLUMNS)
+
+    def __len__(self):
+        return len(self._files)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield SongView(self, idx)
+
+    def add(self, path, record):
+        # record: (title, artist, album, length, bitrate),
+        # returns SongView of added song
+        (title, artist, album, length, bitrate) = record
+        (dir_, filename) = os.path.split(path)
+        if not self.use_tags:
+            title = artist = album = ''
+        self._dirs.append(self._intern(dir_))
+        self._files.append(filename)
+        self._titles.append(title or '')
+        self._artists.append(self._intern(artist or ''))
+        self._albums.append(self._intern(album or ''))
+        self._lengths.append(float('nan') if length is None else length)
+        self._bitrates.append(bitrate or 0)
+        return SongView(self, len(self._files) - 1)
+
+    def _intern(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+        return name_id
+
+    def path(self, idx):
+        return os.path.join(self._names[self._dirs[idx]], self._files[idx])
+
+    def filename(self, idx):
+        return self._files[idx]
+
+    def title(self, idx):
+        return self._titles[idx]
+
+    def artist(self, idx):
+        return self._names[self._artists[idx]]
+
+    def album(self, idx):
+        return self._names[self._albums[idx]]
+
+    def length(self, idx):
+        length = self._lengths[idx]
+        if length != length:  # NaN
+            return None
+        return length
+
+    def bitrate(self, idx):
+        return self._bitrates[idx] or None
+
+    def text(self, idx):
+        # same format as SongInfo's
+        extra_str = ''
+        if self._bitrates[idx]:
+            extra_str = '%dkbps' % (self._bitrates[idx] / 1000)
+        if not self.use_tags or not self._titles[idx]:
+            return '%s [%s]' % (self._files[idx], extra_str)
+        return '%s - %s - %s [%s]' % (
+            self.artist(idx),
+            self.album(idx),
+            self._titles[idx],
+            extra_str)
+
+    def search_text(self, idx):
+        return '%s %s' % (self.path(idx).lower(), self.text(idx).lower())
+
+
+class SongView(object):
+    # one song of Library, usable in place of SongInfo
+    __slots__ = ('_lib', '_idx')
+
+    def __init__(self, lib, idx):
+        self._lib = lib
+        self._idx = idx
+
+    def __eq__(self, other):
+        return (isinstance(other, SongView) and
+                self._lib is other._lib and self._idx == other._idx)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self._lib), self._idx))
+
+    def __str__(self):
+        return self._lib.text(self._idx)
+
+    @property
+    def path(self):
+        return self._lib.path(self._idx)
+
+    @property
+    def filename(self):
+        return self._lib.filename(self._idx)
+
+    @property
+    def title(self):
+        return self._lib.title(self._idx)
+
+    @property
+    def artist(self):
+        return self._lib.artist(self._idx)
+
+    @property
+    def album(self):
+        return self._lib.album(self._idx)
+
+    @property
+    def length(self):
+        return self._lib.length(self._idx)
+
+    @property
+    def bitrate(self):
+        return self._lib.bitrate(self._idx)
+
+    @property
+    def search_text(self):
+        return self._lib.search_text(self._idx)
+
+    def has_substr(self, substr):
+        return substr in self.search_text
+
+    def percent_pos(self, time_pos, raw=False):
+        if time_pos is None:
+            return '100'
+        p = time_pos / ((self.length or 0) / 100.0)
+        if raw:
+            return p
+        return str(int(round(p)))
+
+
+def deep_sizeof(obj, seen=None):
+    # rough memory used by obj and everything it references
+    # (objects shared with other parts are counted just once)
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    if hasattr(obj, '__dict__'):
+        size += deep_sizeof(obj.__dict__, seen)
+    for slot in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, slot):
+            size += deep_sizeof(getattr(obj, slot), seen)
+    return size
+
+
+def _compare_memory(count):
+    # SongInfo list vs Library (+ SongView list) for count songs
+    # of a synthetic collection (10 songs per album, 5 albums per artist)
+    from play2 import SongInfo
+
+    records = []
+    for idx in range(count):
+        artist = 'Artist %d' % (idx // 50)
+        album = 'Album %d' % (idx // 10)
+        title = 'Song title number %d' % idx
+        path = '/all/music/%s/%s/%02d %s.ogg' % (
+            artist, album, idx % 10, title)
+        records.append((path, (title, artist, album,
+                               180.0 + idx % 120, 192000)))
+
+    infos = [SongInfo(path, record=record) for (path, record) in records]
+    lib = Library()
+    views = [lib.add(path, record) for (path, record) in records]
+    assert [str(s) for s in infos] == [str(s) for s in views]
+    assert [s.search_text for s in infos] == [s.search_text for s in views]
+
+    info_size = deep_sizeof(infos)
+    lib_size = deep_sizeof((lib, views))
+    print('%d songs: SongInfo %.1f MiB (%d B/song),'
+          ' Library %.1f MiB (%d B/song), %.0f%%' % (
+              count,
+              info_size / 1048576.0, info_size // count,
+              lib_size / 1048576.0, lib_size // count,
+              100.0 * lib_size / info_size))
+
+
+if __name__ == '__main__':
+    for count in (1000, 10000, 100000):
+        _compare_memory(count)
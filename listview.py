@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from bisect import bisect_left
+import sys
+
+import statusline
+
+CLEAR_EOL = '\x1b[K'
+UP = '\x1b[%dA'
+REVERSE = '\x1b[7m'
+NORMAL = '\x1b[0m'
+
+
+class ListView(object):
+    # Scrollable page of playlist, drawn above the status line and
+    # redrawn in place (cursor goes up over previous page), so playback
+    # goes on meanwhile. Only songs on the page are formatted.
+    #
+    # songs: playlist (sequence of songs, e.g. playqueue.PlayQueue)
+    # index: searchindex.SearchIndex used for filtering, matching songs
+    #   are listed in playlist order
+    # rows: songs per page (by default what fits into terminal)
+    def __init__(self, songs, index=None, stream=None, rows=None):
+        self._songs = songs
+        self._index = index
+        self._stream = stream if stream is not None else sys.stdout
+        self._fixed_rows = rows
+        self.rows = rows
+        self.cols = statusline.DEFAULT_SIZE[1]
+        self.filter = ''
+        self.cursor = 0    # position in listed songs
+        self._top = 0      # first listed song on page
+        self._shown = None  # playlist positions of filtered songs
+        self._drawn = 0    # lines written by last render
+        self._last = None  # last frame (to skip same ones)
+        self.resize()
+
+    def __len__(self):
+        if self._shown is None:
+            return len(self._songs)
+        return len(self._shown)
+
+    def resize(self):
+        try:
+            (rows, self.cols) = statusline.terminal_size(
+                self._stream.fileno())
+        except (AttributeError, ValueError, IOError):
+            rows = statusline.DEFAULT_SIZE[0]
+        if self._fixed_rows is None:
+            # (header and status line take two)
+            self.rows = max(1, rows - 2)
+        self._last = None
+
+    def position(self):
+        # playlist position of song under cursor (or None)
+        if not len(self):
+            return None
+        if self._shown is None:
+            return self.cursor
+        return self._shown[self.cursor]
+
+    def set_filter(self, text):
+        self.filter = text
+        position = self.position()
+        if not text.strip() or self._index is None:
+            self._shown = None
+        else:
+            shown = []
+            for song in self._index.matches(text):
+                idx = self._songs.index_of(song.path)
+                if idx is not None:
+                    shown.append(idx)
+            self._shown = sorted(shown)
+        self.show(position if position is not None else 0)
+
+    def show(self, position):
+        # moves cursor to playlist position (or nearest listed song)
+        if self._shown is None:
+            self.move_to(position)
+        else:
+            self.move_to(bisect_left(self._shown, position))
+        # (keep some songs before it visible)
+        self._top = max(0, self.cursor - self.rows // 3)
+
+    def move(self, delta):
+        self.move_to(self.cursor + delta)
+
+    def move_to(self, cursor):
+        self.cursor = max(0, min(len(self) - 1, cursor))
+        if self.cursor < self._top:
+            self._top = self.cursor
+        elif self.cursor >= self._top + self.rows:
+            self._top = self.cursor - self.rows + 1
+
+    def render(self, current):
+        # (re)draws page, current: playlist position of playing song,
+        # returns True when anything was written
+        if len(self) <= self.cursor:
+            self.move_to(self.cursor)  # playlist may have shrunk
+        self._top = max(0, min(self._top, len(self) - self.rows))
+        lines = [self._header()]
+        for row in range(self._top, min(len(self), self._top + self.rows)):
+            lines.append(self._line(row, current))
+        frame = tuple(lines)
+        if frame == self._last:
+            return False
+        out = ['\r']
+        if self._drawn:
+            out.append(UP % self._drawn)
+        for line in lines:
+            out.append(line + CLEAR_EOL + '\r\n')
+        for _ in range(len(lines), self._drawn):
+            # (page got shorter, clear what's left of previous one)
+            out.append(CLEAR_EOL + '\r\n')
+        self._stream.write(''.join(out))
+        self._stream.flush()
+        self._drawn = max(len(lines), self._drawn)
+        self._last = frame
+        return True
+
+    def close(self):
+        self._drawn = 0
+        self._last = None
+
+    def _header(self):
+        shown = '%d/%d' % (self.cursor + 1 if len(self) else 0, len(self))
+        if self._shown is not None:
+            shown += ' of %d' % len(self._songs)
+        text = 'list: %s' % self.filter
+        width = self.cols - len(shown) - 2
+        return text[:width].ljust(width) + ' ' + shown
+
+    def _line(self, row, current):
+        idx = row if self._shown is None else self._shown[row]
+        song = self._songs[idx]
+        mark = '>' if idx == current else ' '
+        text = '%s%6d %s' % (mark, idx + 1, song)
+        text = text[:self.cols - 1]
+        if row == self.cursor:
+            return REVERSE + text.ljust(self.cols - 1) + NORMAL
+        return text
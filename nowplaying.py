@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import mmap
+import os
+import struct
+import time
+
+TEXT_PATH = '~/.nowplaying'
+STATUS_PATH = '~/.cache/play/nowplaying.status'
+MAGIC = b'PLAYNOW\0'
+VERSION = 1
+
+# magic, version, sequence counter (odd while being written)
+HEADER = struct.Struct('<8sIQ')
+# time_pos, length, volume (NaN when unknown), paused (-1 unknown),
+# index of song, songs in playlist, bytes of text and path used,
+# text (as shown in status line) and path, both utf-8
+FIELDS = struct.Struct('<dddbiiHH512s1024s')
+SIZE = HEADER.size + FIELDS.size
+NAN = float('nan')
+
+
+def _number(value):
+    return NAN if value is None else float(value)
+
+
+def _encoded(text, size):
+    # utf-8 cut to size bytes (without splitting a character)
+    data = text.encode('utf-8')
+    if len(data) > size:
+        data = data[:size].decode('utf-8', 'ignore').encode('utf-8')
+    return data
+
+
+class NowPlaying(object):
+    # Exports what is being played:
+    #  - fixed layout status file (STATUS_PATH), mapped and rewritten
+    #    in place with sequence counter (seqlock) - readers (see read)
+    #    retry while it is odd or changed meanwhile, so they never see
+    #    half written status, nor do they need any lock
+    #  - plain text file (TEXT_PATH) with song, written only when song
+    #    changes, to temporary file renamed over it
+    #
+    # update() writes at most once per min_interval secs (unless
+    # song or pause changed, or it's forced), so it can be called
+    # on each tick.
+    def __init__(self, text_path=TEXT_PATH, status_path=STATUS_PATH,
+                 min_interval=0.25):
+        self.text_path = os.path.expanduser(text_path)
+        self.status_path = os.path.expanduser(status_path)
+        self.min_interval = min_interval
+        self._last_time = 0
+        self._last_text = None
+        self._last_paused = None
+        self._seq = 0
+        dir_ = os.path.dirname(self.status_path)
+        if dir_ and not os.path.isdir(dir_):
+            os.makedirs(dir_)
+        fd = os.open(self.status_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != SIZE:
+                os.ftruncate(fd, SIZE)
+            self._map = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        (magic, version, seq) = HEADER.unpack_from(self._map)
+        if magic == MAGIC and version == VERSION:
+            self._seq = seq + seq % 2  # (continue after previous one)
+        self._write_status(FIELDS.pack(NAN, NAN, NAN, -1, -1, 0, 0, 0,
+                                       b'', b''))
+
+    def update(self, text, path, index, total, time_pos, length, volume,
+               paused, force=False):
+        now = time.time()
+        if (not force and text == self._last_text and
+                paused == self._last_paused and
+                now - self._last_time < self.min_interval):
+            return False
+        self._last_time = now
+        self._last_paused = paused
+        text_data = _encoded(text, 512)
+        path_data = _encoded(path, 1024)
+        self._write_status(FIELDS.pack(
+            _number(time_pos), _number(length), _number(volume),
+            -1 if paused is None else int(bool(paused)),
+            index, total, len(text_data), len(path_data),
+            text_data, path_data))
+        if text != self._last_text:
+            self._last_text = text
+            self._write_text(text)
+        return True
+
+    def clear(self):
+        # nothing is played anymore
+        self._write_status(FIELDS.pack(NAN, NAN, NAN, -1, -1, 0, 0, 0,
+                                       b'', b''))
+        self._last_text = None
+        self._last_paused = None
+        try:
+            os.remove(self.text_path)
+        except OSError:
+            pass
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _write_status(self, fields):
+        self._seq += 1  # odd - being written
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, self._seq)
+        self._map[HEADER.size:SIZE] = fields
+        self._seq += 1
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, self._seq)
+
+    def _write_text(self, text):
+        tmp_path = '%s.%d.tmp' % (self.text_path, os.getpid())
+        with open(tmp_path, 'wb') as text_file:
+            text_file.write(text.encode('utf-8'))
+        os.rename(tmp_path, self.text_path)
+
+
+def read(status_path=STATUS_PATH, retries=100):
+    # dict of consistent status written by NowPlaying (None when there
+    # is none), for status bars and alike
+    try:
+        with open(os.path.expanduser(status_path), 'rb') as status_file:
+            status_map = mmap.mmap(status_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        if len(status_map) < SIZE:
+            return None
+        for _ in range(retries):
+            (magic, version, seq) = HEADER.unpack_from(status_map)
+            if magic != MAGIC or version != VERSION:
+                return None
+            if seq % 2:
+                time.sleep(0.001)
+                continue
+            fields = FIELDS.unpack_from(status_map, HEADER.size)
+            if HEADER.unpack_from(status_map)[2] == seq:
+                break
+        else:
+            return None
+    finally:
+        status_map.close()
+    (time_pos, length, volume, paused, index, total, text_len, path_len,
+     text, path) = fields
+    if index < 0:
+        return {'playing': False}
+    return {
+        'playing': True,
+        'text': text[:text_len].decode('utf-8'),
+        'path': path[:path_len].decode('utf-8'),
+        'index': index,
+        'total': total,
+        'time_pos': None if time_pos != time_pos else time_pos,
+        'length': None if length != length else length,
+        'volume': None if volume != volume else volume,
+        'paused': None if paused < 0 else bool(paused),
+    }
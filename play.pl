@@ -5,6 +5,7 @@ use Pod::Usage;
 use Getopt::Long;
 use File::Temp qw/ tempfile /;
 use Cwd qw/ abs_path /;
+use File::Basename qw/ dirname /;
 
 
 # --- default configuration ------
@@ -49,6 +50,19 @@ sub find_songs {
 	return @selected;
 }
 
+sub library_songs {
+	# songs of library exported by play2.py (or of M3U/PLS playlist)
+	my ($file) = @_;
+	my $libexport = dirname(abs_path($0)) . '/libexport.py';
+
+	open(my $lh, '-|', 'python3', $libexport, $file)
+		|| die("selhalo nacteni ".$file);
+	my @songs = <$lh>;
+	close $lh;
+	chomp @songs;
+	return @songs;
+}
+
 sub create_playlist {
 	my ($selectedRef) = @_;
 	my (@selected) = @$selectedRef;
@@ -76,10 +90,15 @@ if ( not $dir ) {
 	$dir = $music;
 }
 $dir = abs_path($dir);
-my $song_dir = $dir;
-$song_dir = find_artist($dir) if not $exact;
-
-my @selected = find_songs($song_dir);
+my @selected;
+if ( -f $dir ) {
+	@selected = library_songs($dir);
+} else {
+	my $song_dir = $dir;
+	$song_dir = find_artist($dir) if not $exact;
+
+	@selected = find_songs($song_dir);
+}
 
 die("Nenalezeny zadne songy!") if not @selected;
 
@@ -96,7 +115,7 @@ Script to play your music collection in random fashion.
 
 =head1 SYNOPSIS
 
-B<play> [-h | -m | music_dir | -e song_dir]
+B<play> [-h | -m | music_dir | -e song_dir | playlist]
 
 Options:
 
@@ -104,6 +123,8 @@ Options:
     -m, --man             full help/description
     -e, --exact song_dir  use song_dir as source of songs
     music_dir             select random subdir from music_dir as source of songs
+    playlist              play songs of library exported by play2.py
+                          (or of M3U/PLS playlist), nothing is searched for
 
 Without music_dir/exact dir B<play> will use predefined
 music directory (see $music at start of source code).
@@ -118,6 +139,8 @@ music directory (see $music at start of source code).
 
 =item * play -e /path/to/songs/directory
 
+=item * play /path/to/exported.lib
+
 =back
 
 =head1 DESCRIPTION
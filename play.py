@@ -1,12 +1,21 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
-"""play.py [-h|--help] [-m|--man] [-e|--exact] [music-dir]"""
+"""play.py [-h|--help] [-m|--man] [-e|--exact] [-S|--stream]
+ [music-dir|playlist]"""
+import errno
 import os
+import re
+import shutil
 import sys
-from random import choice
-from stat import *
-from tempfile import NamedTemporaryFile
-from subprocess import call, PIPE
+import threading
+import time
+from queue import Queue, Empty
+from random import choice, randrange
+from tempfile import NamedTemporaryFile, mkdtemp
+from subprocess import call, Popen, PIPE
+
+from libexport import song_paths
+from walker import SongWalker
 
 
 # --- default configuration ------
@@ -14,23 +23,212 @@ from subprocess import call, PIPE
 player = ['mplayer', '-shuffle',
           '-msglevel', 'all=-1:demux=4:statusline=5',
           '-vo', 'null', '-playlist']
+# (-S: no -shuffle nor -playlist, songs are passed while being found)
+# (-idle, so it waits for songs still being found, global=6 for
+#  EOF lines telling which ended)
+stream_player = ['mplayer', '-idle',
+                 '-msglevel', 'all=-1:demux=4:statusline=5:global=6',
+                 '-vo', 'null']
 collection = "/all/hudba/"
+scan_threads = 4  # directories scanned at once
+shuffle_window = 64  # songs shuffled at once while streaming (-S)
+first_window = 16  # ... and when choosing the first one
+first_wait = 0.5  # (or of songs found in this many seconds)
+queue_low = 2  # songs mplayer has, below which held ones are passed
+idle_wait = 1.0  # seconds of mplayer's silence when all songs ended
 # --- end default configuration --
 
 
-def find_songs(dir_):
+def iter_songs(dir_):
     supported = ('mp3', 'ogg', 'flv', 'flac')
-    songs = []
-    dirs = [dir_]
-    for dir_ in dirs:
-        for sub in os.listdir(dir_):
-            pathname = os.path.join(dir_, sub)
-            mode = os.stat(pathname)[ST_MODE]
-            if S_ISDIR(mode):
-                dirs.append(pathname)
-            elif S_ISREG(mode) and pathname.endswith(supported):
-                songs.append(pathname)
-    return songs
+    return SongWalker(supported, threads=scan_threads).iter_songs(dir_)
+
+
+def find_songs(dir_):
+    return list(iter_songs(dir_))
+
+
+def take_found(found, held, timeout):
+    # moves songs found meanwhile (waiting for timeout for first one)
+    # from found queue to held ones, False once the walk ended
+    try:
+        song = found.get(True, timeout)
+        while song is not None:
+            held.append(song)
+            song = found.get_nowait()
+        return False
+    except Empty:
+        return True
+
+
+def pop_random(held):
+    idx = randrange(len(held))
+    (held[idx], held[-1]) = (held[-1], held[idx])
+    return held.pop()
+
+
+def loadfile_command(song):
+    # mplayer's input command appending song to its playlist,
+    # None when song's path can't be quoted for it
+    for quote in '"\'':
+        if quote not in song and '\n' not in song:
+            return 'loadfile %s%s%s 1\n' % (quote, song, quote)
+    return None
+
+
+def open_fifo(path, player):
+    # opens (named pipe at) path for writing once player reads it,
+    # None when player ended before
+    while player.poll() is None:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as exc:
+            if exc.errno != errno.ENXIO:  # (no reader yet)
+                raise
+            time.sleep(0.05)
+            continue
+        os.set_blocking(fd, True)
+        return os.fdopen(fd, 'w', buffering=1)
+    return None
+
+
+class StreamPlayer(object):
+    # mplayer (-idle) started with first song, others are appended
+    # to its playlist through named pipe (its input file, so keys work
+    # as usual); its output is passed through, counting songs that
+    # ended (by 'EOF code:' lines, not shown)
+    EOF = b'EOF code:'
+
+    def __init__(self, first, fifo):
+        self.sent = 1
+        self.ended = 0
+        self.last_output = time.time()
+        self._proc = Popen(stream_player + ['-input', 'file=' + fifo, first],
+                           stdout=PIPE)
+        self._reader = threading.Thread(target=self._pass_output)
+        self._reader.daemon = True
+        self._reader.start()
+        self._commands = open_fifo(fifo, self._proc)
+
+    def running(self):
+        return self._commands is not None and self._proc.poll() is None
+
+    def queued(self):
+        # songs sent which didn't end yet (including the playing one)
+        return self.sent - self.ended
+
+    def idle(self):
+        # all songs sent ended and mplayer is quiet (not even showing
+        # status line), so it's waiting for more
+        return (self.ended >= self.sent
+                and time.time() - self.last_output > idle_wait)
+
+    def append(self, song):
+        command = loadfile_command(song)
+        if command is None:
+            print("** Unable to play: ", song)
+        elif self._send(command):
+            self.sent += 1
+
+    def quit(self):
+        self._send('quit\n')
+
+    def wait(self):
+        self._proc.wait()
+        self._reader.join()
+
+    def close(self):
+        if self._commands is not None:
+            try:
+                self._commands.close()
+            except BrokenPipeError:
+                pass
+            self._commands = None
+        if self._proc.poll() is None:
+            self._proc.terminate()
+
+    def _send(self, command):
+        try:
+            self._commands.write(command)
+            return True
+        except BrokenPipeError:
+            self._commands = None  # (mplayer ended)
+            return False
+
+    def _pass_output(self):
+        out = sys.stdout.buffer
+        rest = b''
+        while True:
+            data = os.read(self._proc.stdout.fileno(), 4096)
+            if not data:
+                break
+            self.last_output = time.time()
+            # (status line is ended by \r, messages by \n)
+            parts = re.split(b'([\r\n])', rest + data)
+            rest = parts.pop()
+            for (line, end) in zip(parts[::2], parts[1::2]):
+                if line.startswith(self.EOF):
+                    self.ended += 1
+                else:
+                    out.write(line + end)
+            if not (self.EOF.startswith(rest) or rest.startswith(self.EOF)):
+                out.write(rest)  # (can't be EOF line, show it now)
+                rest = b''
+            out.flush()
+        out.write(rest)
+        out.flush()
+
+
+def stream_songs(songs):
+    # starts mplayer with first song as soon as some are found, others
+    # are passed to it while being found - shuffled by shuffle_window
+    # songs, or sooner when mplayer has less than queue_low songs to
+    # play, so it doesn't run out of them while walk is slow; first
+    # song is chosen of first_window songs (or of those found
+    # in first_wait seconds), so songs found early tend to be played
+    # early (the rest is shuffled as a whole when all were found)
+    found = Queue()
+
+    def walk():
+        try:
+            for song in songs:
+                found.put(song)
+        finally:
+            found.put(None)
+    walker = threading.Thread(target=walk)
+    walker.daemon = True
+    walker.start()
+
+    held = []
+    walking = True
+    start = time.time()
+    while walking and len(held) < first_window and not (
+            held and time.time() - start > first_wait):
+        walking = take_found(found, held, 0.05)
+    if not held:
+        usage(1, "No songs found!\n")
+    fifo_dir = mkdtemp(prefix='play_')
+    fifo = os.path.join(fifo_dir, 'input')
+    player = None
+    try:
+        os.mkfifo(fifo, 0o600)
+        player = StreamPlayer(pop_random(held), fifo)
+        while player.running():
+            if walking:
+                walking = take_found(found, held, 0.1)
+            elif not held:
+                if player.idle():
+                    player.quit()  # (all songs found were played)
+                    break
+                time.sleep(0.1)
+            while held and (not walking or len(held) >= shuffle_window
+                            or player.queued() < queue_low):
+                player.append(pop_random(held))
+        player.wait()
+    finally:
+        if player is not None:
+            player.close()
+        shutil.rmtree(fifo_dir)
 
 
 def select_artist(dir_):
@@ -63,12 +261,22 @@ def man():
     print("[exact]\tmeans that specified music-dir will be searched for\n",
           "\tsound files as a whole, no artist-subdir selection will occure")
     print()
+    print("[stream]\tstart playing first song as soon as it's found,\n",
+          "\tothers are passed to mplayer while being found\n",
+          "\t(and shuffled here, by %d songs, or less when mplayer\n" %
+          shuffle_window,
+          "\tis about to run out of them), it quits when all ended")
+    print()
+    print("[playlist]\tplay songs of library exported by play2.py\n",
+          "\t(or of M3U/PLS playlist) - nothing is searched for")
+    print()
     help()
 
 
 opt_help = False
 opt_man = False
 opt_exact = False
+opt_stream = False
 music_dir = ''
 for opt in sys.argv[1:]:
     if opt == '-h' or opt == '--help':
@@ -77,6 +285,8 @@ for opt in sys.argv[1:]:
         opt_man = True
     elif opt == '-e' or opt == '--exact':
         opt_exact = True
+    elif opt == '-S' or opt == '--stream':
+        opt_stream = True
     else:
         music_dir = opt
 if opt_help:
@@ -87,17 +297,28 @@ if opt_man:
 if not music_dir:
     music_dir = collection
 
-if not os.path.isdir(music_dir):
-    usage(1, "Music directory ({}) doesn't exists!\n".format(music_dir))
+if os.path.isfile(music_dir):
+    songs = song_paths(music_dir)
+else:
+    if not os.path.isdir(music_dir):
+        usage(1, "Music directory ({}) doesn't exists!\n".format(music_dir))
+
+    music_dir = os.path.abspath(music_dir)
+    selected = music_dir
 
-music_dir = os.path.abspath(music_dir)
-selected = music_dir
+    if not opt_exact:
+        selected = select_artist(music_dir)
 
-if not opt_exact:
-    selected = select_artist(music_dir)
+    songs = iter_songs(selected)
 
-songs = find_songs(selected)
+if opt_stream:
+    try:
+        stream_songs(songs)
+    except KeyboardInterrupt:
+        print("... koncim")
+    sys.exit(0)
 
+songs = list(songs)
 file_ = NamedTemporaryFile(
     mode='w', dir='/tmp/',
     prefix='play_', suffix='.pls',
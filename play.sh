@@ -8,6 +8,16 @@ MUSIC_DIR="/all/hudba/"
 
 PLAYLIST=$(mktemp "/tmp/play_XXXXXX.pls")
 
+if [ -f "${1}" ];
+then
+	# library exported by play2.py (or M3U/PLS playlist), no searching
+	python3 "$(dirname "$(readlink -f "${0}")")/libexport.py" "${1}" > ${PLAYLIST}
+	echo "**** Playlist ${PLAYLIST} created with $(wc -l ${PLAYLIST}) songs"
+	${PLAYER} "${PLAYLIST}"
+	rm "${PLAYLIST}"
+	exit
+fi
+
 if [ -d "${1}" ];
 then
 	SELECTED=$(readlink -f "${1}")
@@ -2,22 +2,59 @@
 # -*- coding: utf-8 -*-
 # vim: set et sw=4 ts=4 ft=python:
 """play.py [-h|--help] [-m|--man] [-n|--notags]
- [-s|--sorted] [-e|--exact] [music-dir]"""
+ [-s|--sorted] [-e|--exact] [-c|--nocache] [-R|--refresh]
+ [-j|--jobs N] [-T|--threads N] [-S|--stream]
+ [-C|--compact] [-w|--watch] [-a|--readahead N]
+ [-g|--gapless] [-F|--fast] [-P|--profile] [--profile-dump FILE]
+ [-W|--weight size|age] [-D|--device-scans [PATH=]N]
+ [-d|--daemon] [--socket PATH] [-i|--import FILE]
+ [-f|--filter QUERY] [-L|--limit N] [-o|--export FILE] [music-dir ...]
+play.py [--socket PATH] -A|--attach
+play.py [--socket PATH] -x|--send COMMAND [ARGUMENT]
+play.py -N|--nowplaying"""
 from __future__ import print_function, unicode_literals
-import mplayer
+import json
+import multiprocessing
 import os
 import pprint
 import random
-import stat
+import signal
 import subprocess
 import sys
+import threading
 import time
-import mutagen
-
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+import artistindex
+import control
+import eventloop
+import libexport
+import library
+import listview
+import nowplaying
+import playerstate
+import playqueue
+import prefetch
+import profiling
 import qsio
+import searchindex
+import snapshot
+import statusline
+import tagcache
+import walker
+import watcher
 
 # --- default configuration ------
-DEFAULT_COLLECTION = "/all/music/"
+DEFAULT_COLLECTION = ("/all/music/",)  # one or more music dirs
+SONG_EXTENSIONS = ('mp3', 'ogg', 'flv', 'flac', 'webm', 'mp4')
+IGNORED_NAMES = ('.*',)  # fnmatch patterns (dirs and files)
+STATUS_INTERVAL = 0.1  # secs between status line updates while playing
+READAHEAD_BUDGET = 32 * 1024 * 1024  # bytes of next songs to read ahead
+GAPLESS_AHEAD = 5  # secs before end of song when next one is queued
+NOWPLAYING_INTERVAL = 0.25  # secs between now-playing status exports
 # --- end default configuration --
 
 
@@ -43,6 +80,109 @@ def man():
     print("[sorted]\tdisables random shuffling,\n",
           "\tso songs are always played in the same alphab. sorted order")
     print()
+    print("[nocache]\tdo not use persistent tag cache (%s),\n" %
+          tagcache.DEFAULT_PATH,
+          "\tso tags of all songs are read again on each start,\n",
+          "\tnor artist index (%s), so artists are listed again" %
+          artistindex.DEFAULT_PATH)
+    print()
+    print("[refresh]\tignore entries stored in tag cache\n",
+          "\tand refresh them all from the song files")
+    print()
+    print("[jobs]\tread tags of songs in N worker processes\n",
+          "\t(0 means one per cpu, default is 1 - no workers)")
+    print()
+    print("[threads]\tscan N directories at once when looking up songs\n",
+          "\t(helps with slow/network filesystems, default is 1)")
+    print()
+    print("[stream]\tstart playing as soon as first song is found,\n",
+          "\tsongs found later are (shuffled) into not yet played part")
+    print()
+    print("[compact]\tkeep songs in compact library store,\n",
+          "\tuses less memory for big collections")
+    print()
+    print("[watch]\twatch selected directory (inotify) while playing,\n",
+          "\tadded/removed/rewritten songs are updated in song list")
+    print()
+    print("[readahead]\tread ahead N next songs of playlist (up to %d MiB)\n" %
+          (READAHEAD_BUDGET // (1024 * 1024)),
+          "\tso they load without waiting for slow disk (0 disables)")
+    print()
+    print("[gapless]\tqueue next song in mplayer before current one ends,\n",
+          "\tso there is no silence between songs")
+    print()
+    print("[fast]\tfast start - keep scanned songs in snapshot (in %s),\n" %
+          snapshot.DEFAULT_DIR,
+          "\tused while no directory in selected one changes\n",
+          "\t(implies compact)")
+    print()
+    print("[profile]\tmeasure time spent scanning, reading tags, building\n",
+          "\tplaylist, per status tick, in key handlers and mplayer calls\n",
+          "\tand print summary (with slowest files) on exit")
+    print()
+    print("[profile-dump]\tprofile and write also FILE - JSON trace\n",
+          "\t(chrome://tracing) when it ends with .json, cProfile otherwise")
+    print()
+    print("[weight]\tpick artist (directory) not uniformly, but by its\n",
+          "\tsize (number of tracks) or age (time since it was picked)")
+    print()
+    print("[device-scans]\tnumber of music dirs scanned at once on one\n",
+          "\tdevice (disk/mount, default is 1) - music dirs on different\n",
+          "\tdevices are scanned concurrently, PATH=N sets it just for\n",
+          "\tdevice of PATH (e.g. more for NFS), can be repeated")
+    print()
+    print("[music-dir]\tone or more roots of music collection (%s\n" %
+          ' '.join(DEFAULT_COLLECTION),
+          "\tby default), same named artist dirs in them are one artist")
+    print()
+    print("[daemon]\tplay without terminal, controlled through unix socket\n",
+          "\t(%s by default, see socket), songs stay loaded\n" %
+          control.DEFAULT_SOCKET,
+          "\tand it goes on with next artist when playlist ends")
+    print()
+    print("[socket]\tcontrol socket of daemon (to run it with or to connect)")
+    print()
+    print("[attach]\tcontrol running daemon from terminal - n/p next and\n",
+          "\tprevious song, +/- volume, space pause, ~ repick,\n",
+          "\ts stops daemon, q detaches")
+    print()
+    print("[send]\tsend COMMAND to running daemon and print its result:\n",
+          "\tstatus, next, prev, pause, stop, repick, volume [[+-]N],\n",
+          "\tjump PATH, play_next PATH, search QUERY, list [START [COUNT]]")
+    print()
+    print("[nowplaying]\tprint (as JSON) what is being played, as exported\n",
+          "\tby running player to %s\n" % nowplaying.STATUS_PATH,
+          "\t(song as text is in %s too)" % nowplaying.TEXT_PATH)
+    print()
+    print("[import]\tplay songs of FILE instead of music dirs (no scanning,\n",
+          "\tno tags read) - library written by export, or M3U/PLS\n",
+          "\tplaylist (or plain one, path per line)")
+    print()
+    print("[filter]\tplay only songs matching QUERY (as search)")
+    print()
+    print("[limit]\tplay only first N songs (after shuffle and filter)")
+    print()
+    print("[export]\tdo not play, write playlist (picked artist or\n",
+          "\timported songs, shuffled/sorted, filtered and limited)\n",
+          "\tto FILE at once - M3U (.m3u/.m3u8), PLS (.pls) or compact\n",
+          "\tbinary library (anything else) with tags, for import\n",
+          "\t(which reads it streamed) or mplayer front ends (play.sh,\n",
+          "\tplay.pl and play.py play it as well)")
+    print()
+    print("[search]\twhile playing, '/' starts search of songs,\n",
+          "\tterms can be limited to artist:, album:, title:, file:\n",
+          "\tor path:, number of matching songs and best ones are shown\n",
+          "\t(all matches are ranked: those in titles, then artists,\n",
+          "\talbums and file names, at start of words first), songs\n",
+          "\tare searched while typing, playback goes on meanwhile,\n",
+          "\tTab/Down and Up move between best matching songs,\n",
+          "\tEnter plays selected song next, Ctrl+A plays all matches next")
+    print()
+    print("[list]\twhile playing, 'l' shows page of playlist around current\n",
+          "\tsong (playback goes on), Up/Down/PgUp/PgDn/Home/End scroll,\n",
+          "\ttyping filters it (as search), Tab goes back to current song,\n",
+          "\tEnter plays selected one, Esc closes it")
+    print()
     help()
 
 
@@ -51,11 +191,36 @@ def get_opts(args):
         'help': False,
         'man': False,
         'exact': False,
-        'music_dir': '',
+        'music_dirs': [],
         'sorted': False,
         'notags': False,
+        'nocache': False,
+        'refresh': False,
+        'jobs': 1,
+        'threads': 1,
+        'stream': False,
+        'compact': False,
+        'watch': False,
+        'readahead': 2,
+        'gapless': False,
+        'profile': False,
+        'profile_dump': None,
+        'fast': False,
+        'weight': None,
+        'device_scans': 1,
+        'device_limits': {},
+        'daemon': False,
+        'socket': None,
+        'attach': False,
+        'send': None,
+        'nowplaying': False,
+        'import': None,
+        'filter': None,
+        'limit': None,
+        'export': None,
     }
-    for opt in args[1:]:
+    args = iter(args[1:])
+    for opt in args:
         if opt == '-h' or opt == '--help':
             opts['help'] = True
         elif opt == '-m' or opt == '--man':
@@ -66,8 +231,91 @@ def get_opts(args):
             opts['sorted'] = True
         elif opt == '-n' or opt == '--notags':
             opts['notags'] = True
+        elif opt == '-c' or opt == '--nocache':
+            opts['nocache'] = True
+        elif opt == '-R' or opt == '--refresh':
+            opts['refresh'] = True
+        elif opt == '-j' or opt == '--jobs':
+            try:
+                opts['jobs'] = int(next(args))
+            except (StopIteration, ValueError):
+                usage(1, "Option %s requires number of jobs" % opt)
+        elif opt == '-T' or opt == '--threads':
+            try:
+                opts['threads'] = int(next(args))
+            except (StopIteration, ValueError):
+                usage(1, "Option %s requires number of threads" % opt)
+        elif opt == '-S' or opt == '--stream':
+            opts['stream'] = True
+        elif opt == '-C' or opt == '--compact':
+            opts['compact'] = True
+        elif opt == '-w' or opt == '--watch':
+            opts['watch'] = True
+        elif opt == '-a' or opt == '--readahead':
+            try:
+                opts['readahead'] = int(next(args))
+            except (StopIteration, ValueError):
+                usage(1, "Option %s requires number of songs" % opt)
+        elif opt == '-g' or opt == '--gapless':
+            opts['gapless'] = True
+        elif opt == '-F' or opt == '--fast':
+            opts['fast'] = True
+        elif opt == '-P' or opt == '--profile':
+            opts['profile'] = True
+        elif opt == '--profile-dump':
+            try:
+                opts['profile_dump'] = next(args)
+            except StopIteration:
+                usage(1, "Option %s requires file name" % opt)
+            opts['profile'] = True
+        elif opt == '-W' or opt == '--weight':
+            opts['weight'] = next(args, None)
+            if opts['weight'] not in artistindex.WEIGHTS:
+                usage(1, "Option %s requires one of: %s" % (
+                    opt, ', '.join(artistindex.WEIGHTS)))
+        elif opt == '-d' or opt == '--daemon':
+            opts['daemon'] = True
+        elif opt == '--socket':
+            opts['socket'] = next(args, None)
+            if opts['socket'] is None:
+                usage(1, "Option %s requires socket path" % opt)
+        elif opt == '-A' or opt == '--attach':
+            opts['attach'] = True
+        elif opt == '-x' or opt == '--send':
+            opts['send'] = list(args)  # (rest is the command)
+            if not opts['send']:
+                usage(1, "Option %s requires command" % opt)
+        elif opt == '-N' or opt == '--nowplaying':
+            opts['nowplaying'] = True
+        elif opt == '-i' or opt == '--import':
+            opts['import'] = next(args, None)
+            if opts['import'] is None:
+                usage(1, "Option %s requires file name" % opt)
+        elif opt == '-f' or opt == '--filter':
+            opts['filter'] = next(args, None)
+            if opts['filter'] is None:
+                usage(1, "Option %s requires query" % opt)
+        elif opt == '-L' or opt == '--limit':
+            try:
+                opts['limit'] = int(next(args))
+            except (StopIteration, ValueError):
+                usage(1, "Option %s requires number of songs" % opt)
+        elif opt == '-o' or opt == '--export':
+            opts['export'] = next(args, None)
+            if opts['export'] is None:
+                usage(1, "Option %s requires file name" % opt)
+        elif opt == '-D' or opt == '--device-scans':
+            (path, _, scans) = next(args, '').rpartition('=')
+            try:
+                scans = int(scans)
+            except ValueError:
+                usage(1, "Option %s requires number of scans" % opt)
+            if path:
+                opts['device_limits'][os.path.abspath(path)] = scans
+            else:
+                opts['device_scans'] = scans
         else:
-            opts['music_dir'] = opt
+            opts['music_dirs'].append(opt)
     return opts
 
 
@@ -82,8 +330,59 @@ def un(string):
     return string.decode('utf-8', 'ignore')
 
 
+def extract_field(song, field_names, default=''):
+    if song.tags is None:
+        return default
+    for name in field_names:
+        default = song.tags.get(name, default)
+        if default:
+            if isinstance(default, list):
+                return default[0]
+            return default
+
+
+def read_record_timed(songpath):
+    # (read_record(songpath), secs it took), for profiling in workers
+    start = time.time()
+    record = read_record(songpath)
+    return (record, time.time() - start)
+
+
+def read_record(songpath):
+    # (title, artist, album, length, bitrate) as found by mutagen
+    import mutagen  # (here, as with valid snapshot it's not needed at all)
+    title = artist = album = ''
+    length = bitrate = None
+    song = mutagen.File(songpath, easy=True)
+    if getattr(song, 'tags', None):
+        title = extract_field(song, ('title', 'TITLE'))
+        artist = extract_field(song, ('artist', 'ARTIST'))
+        album = extract_field(song, ('album', 'ALBUM', 'ALBUMTITLE'))
+    if getattr(song, 'info', None):
+        length = getattr(song.info, 'length', None)
+        bitrate = getattr(song.info, 'bitrate', None)
+    return (title, artist, album, length, bitrate)
+
+
+def _init_worker():
+    # ^c is handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def load_record(songpath, cache=None):
+    # like read_record, but consult tagcache.TagCache first (if any)
+    if cache is None:
+        return read_record(songpath)
+    st = os.stat(songpath)
+    record = cache.get(songpath, st)
+    if record is None:
+        record = read_record(songpath)
+        cache.put(songpath, st, record)
+    return record
+
+
 class SongInfo(object):
-    def __init__(self, songpath, use_tags=True):
+    def __init__(self, songpath, use_tags=True, cache=None, record=None):
         self.path = songpath
         self.filename = os.path.basename(songpath)
         self.title = ''
@@ -95,7 +394,7 @@ class SongInfo(object):
         self._length_perc = 0
 
         if songpath:
-            self._extract_info(songpath, use_tags)
+            self._extract_info(songpath, use_tags, cache, record)
         else:
             self._text = '- not found -'
             return
@@ -133,6 +432,10 @@ class SongInfo(object):
     def __str__(self):
         return self._text
 
+    @property
+    def search_text(self):
+        return self._text_for_search
+
     def has_substr(self, substr):
         return substr in self._text_for_search
 
@@ -144,69 +447,251 @@ class SongInfo(object):
             return p
         return str(int(round(p)))
 
-    def _extract_info(self, songpath, use_tags=True):
-        song = mutagen.File(songpath, easy=True)
-        if use_tags and getattr(song, 'tags', None):
-            self.title = self._extract_field(
-                song, ('title', 'TITLE'))
-            self.artist = self._extract_field(
-                song, ('artist', 'ARTIST'))
-            self.album = self._extract_field(
-                song, ('album', 'ALBUM', 'ALBUMTITLE'))
-        if getattr(song, 'info', None):
-            self.length = getattr(song.info, 'length', None)
-            self.bitrate = getattr(song.info, 'bitrate', None)
-
-    def _extract_field(self, song, field_names, default=''):
-        if song.tags is None:
-            return default
-        for name in field_names:
-            default = song.tags.get(name, default)
-            if default:
-                if isinstance(default, list):
-                    return default[0]
-                return default
+    def _extract_info(self, songpath, use_tags=True, cache=None,
+                      record=None):
+        if record is None:
+            record = load_record(songpath, cache)
+        (title, artist, album, self.length, self.bitrate) = record
+        if use_tags:
+            self.title = title
+            self.artist = artist
+            self.album = album
 
 
 class Player(object):
-    def __init__(self, music_dir, exact_folder=False, shuffle=True,
-                 show_tags=True):
+    def __init__(self, music_dirs, exact_folder=False, shuffle=True,
+                 show_tags=True, tag_cache=None, jobs=1, scan_threads=1,
+                 stream=False, compact=False, watch=False, readahead=0,
+                 gapless=False, profiler=None, fast=False,
+                 artist_index=None, device_scans=1, device_limits=None,
+                 daemon=False, socket=None, import_path=None,
+                 song_filter=None, limit=None, playing=True):
         self._no_song = SongInfo('')
-        self._player = mplayer.Player(args=('-novideo',),
-                                      stderr=subprocess.STDOUT)
-        self.music_dir = music_dir
+        # 'Starting playback...' (cplayer) and 'EOF code:' (global)
+        # messages tell when song was loaded and when it ended
+        args = ('-novideo', '-msglevel', 'global=6:cplayer=4')
+        if gapless:
+            args += ('-gapless-audio',)
+        # mplayer (importing mplayer.py runs mplayer to introspect it)
+        # is started while songs are being loaded, see _wait_for_mplayer
+        self._player = None
+        self._state = None
+        self._mplayer_error = None
+        self._mplayer_thread = None
+        if playing:
+            self._mplayer_thread = threading.Thread(
+                target=self._start_mplayer, args=(args,))
+            self._mplayer_thread.daemon = True
+            self._mplayer_thread.start()
+        self._profiler = profiler or profiling.NullProfiler()
+        # (hot paths get no profiler at all when it's off)
+        self._hot_profiler = profiler if self._profiler.enabled else None
+        self._loop = eventloop.EventLoop()
+        self._status_timer = None
+        self._loading = False
+        self._song_loaded = False
+        self._song_done = True  # (no song being played)
+        self.music_dirs = list(music_dirs)
         self.exact_folder = exact_folder
         self.shuffle = shuffle
         self.show_tags = show_tags
+        self._tag_cache = tag_cache
+        self.jobs = jobs or multiprocessing.cpu_count()
+        # (filter, limit and export need whole list)
+        self.stream = (stream and playing and import_path is None and
+                       song_filter is None and limit is None)
+        self.fast = fast
+        self.compact = compact or fast
+        self._library = None
+        self.watch = watch and playing and import_path is None
+        self.playing = playing
+        self.import_path = import_path
+        self.song_filter = song_filter
+        self.limit = limit
+        self.readahead = readahead
+        self.gapless = gapless
+        self._queued = None  # song appended to mplayer's playlist
+        self._prefetcher = None
+        if readahead > 0:
+            self._prefetcher = prefetch.Prefetcher(READAHEAD_BUDGET)
+        # (artists of music_dirs and songs loaded for recent ones)
+        self._artist_index = artist_index
+        if artist_index is None:
+            self._artist_index = artistindex.ArtistIndex(music_dirs, None)
+        self._watcher = None
+        self._watch_timer = None
+        self._scan_threads = scan_threads
+        self._walker = walker.SongWalker(
+            SONG_EXTENSIONS, IGNORED_NAMES, threads=scan_threads,
+            progress=None if stream else walker.print_progress)
+        # (several dirs are scanned at once, limited per device)
+        self._scanner = walker.RootScanner(
+            self._new_walker, device_scans, device_limits,
+            progress=None if stream else walker.print_roots_progress)
+        self._incoming = None
+        self._stream_thread = None
+        self._stream_cancel = None
         self.volume_diff = 5
+        self.search_limit = 10
         self._last_vol = None
-        self._cols = self._term_cols()
-        self._songs = []
+        self.daemon = daemon
+        self._stopped = False
+        self._control = None
+        if daemon:
+            self._control = control.ControlServer(
+                self._loop, socket, self._control_commands(),
+                after_command=self._on_command)
+            self._control.start()  # (main() checked none is running)
+            # (nobody to show status line to)
+            self._status = statusline.StatusLine(open(os.devnull, 'w'))
+        else:
+            self._status = statusline.StatusLine()
+        self._songs = playqueue.PlayQueue()
+        self._listing = None  # listview.ListView while it's shown
+        self._searcher = None  # searchindex.IncrementalSearch, ditto
+        self._nowplaying = None  # (created with first song played)
 
         self._pick_playlist()
+        self._wait_for_mplayer()
+
+    def _start_mplayer(self, args):
+        # runs in background thread
+        try:
+            import mplayer
+            self._player = mplayer.Player(
+                args=args, stderr=subprocess.STDOUT)
+        except Exception as exc:
+            self._mplayer_error = exc
+
+    def _wait_for_mplayer(self):
+        if self._mplayer_thread is None:
+            return
+        self._mplayer_thread.join()
+        self._mplayer_thread = None
+        if self._mplayer_error is not None:
+            raise self._mplayer_error
+        self._player.stdout.connect(self._on_player_output)
+        # properties are read from snapshot refreshed once per tick
+        self._state = playerstate.PlayerState(
+            self._player, self._hot_profiler)
 
     def _pick_playlist(self):
         self._changed = False
         self._last_info = None
+        self._close_searcher()
         self._searching = None
         self._search_hit = self._no_song
+        self._search_hits = []
+        self._search_count = 0
         self._search_changed = False
+        self._stop_stream()
+        if self.compact:
+            self._library = library.Library(self.show_tags)
 
-        picked_music_dir = self.music_dir
-        if not self.exact_folder:
-            picked_music_dir = self._select_artist(picked_music_dir)
-        print('\rSelected directory: %s' % picked_music_dir)
-
-        self._songs = self._load_songs(
-            self._find_songs(picked_music_dir))
+        if self.import_path is not None:
+            with self._profiler.span('import', self.import_path):
+                self._songs = self._import_songs(self.import_path)
+        else:
+            songs = self._load_picked()
+            if songs is None:
+                return  # (being streamed into playlist)
+            self._songs = songs
 
         print('\rTotal %d songs' % len(self._songs))
 
-        if self.shuffle:
-            random.shuffle(self._songs)
-            print('\rShuffled song list.')
+        with self._profiler.span('playlist'):
+            if self.shuffle:
+                random.shuffle(self._songs)
+                print('\rShuffled song list.')
+            else:
+                self._songs = sorted(self._songs)
+            if self.song_filter is not None:
+                matched = set(searchindex.SearchIndex(self._songs).matches(
+                    self.song_filter))
+                self._songs = [song for song in self._songs
+                               if song in matched]
+                print('\r%d songs match filter.' % len(self._songs))
+            if self.limit is not None:
+                self._songs = self._songs[:self.limit]
+            self._songs = playqueue.PlayQueue(self._songs)
+            self._search_index = searchindex.SearchIndex(self._songs)
+        if self.playing:
+            self._search_index.build_async()  # (export needs no search)
+
+    def _load_picked(self):
+        # songs of picked artist (or whole collection), None when
+        # they are being streamed
+        picked_dirs = self.music_dirs
+        if not self.exact_folder:
+            picked_dirs = self._select_artist()
+        print('\rSelected directory: %s' % ', '.join(picked_dirs))
+        # (songs of picked dirs are kept/snapshotted together)
+        picked_key = '\n'.join(picked_dirs)
+
+        if self.watch:
+            self._start_watching(picked_dirs)
+
+        if self.stream:
+            self._start_stream(picked_dirs)
+            self._search_index = searchindex.SearchIndex()
+            print('\rStreaming song list.')
+            return None
+
+        songs = self._artist_index.loaded(picked_key)
+        scanned = False
+        if songs is not None:
+            print('\rReusing %d already loaded songs.' % len(songs))
+        elif self.fast:
+            with self._profiler.span('snapshot', picked_key):
+                songs = self._load_snapshot(picked_key)
+        if songs is None:
+            dirs = []
+            with self._profiler.span('scan', picked_key):
+                song_files = self._find_songs(picked_dirs, dirs)
+            with self._profiler.span('load'):
+                songs = self._load_songs(song_files)
+            if self.fast:
+                self._save_snapshot(picked_key, dirs)
+            self._artist_index.keep(picked_key, songs, dirs)
+            scanned = True
+        if len(picked_dirs) == 1:
+            # (all songs are of it, their paths aren't read needlessly)
+            self._artist_index.update(picked_dirs[0], songs, scanned)
         else:
-            self._songs = sorted(self._songs)
+            for dir_ in picked_dirs:
+                prefix = os.path.join(walker.unicode_path(dir_), '')
+                self._artist_index.update(dir_, [
+                    song for song in songs
+                    if song.path.startswith(prefix)], scanned)
+        self._artist_index.flush()
+        return songs
+
+    def _import_songs(self, path):
+        # songs of exported library (tags come with it) or of playlist
+        if not libexport.is_library(path):
+            # (streams have no tags to load, missing files are skipped)
+            paths = libexport.read_playlist(path)
+            streams = [song_path for song_path in paths
+                       if libexport.is_url(song_path)]
+            song_files = [song_path for song_path in paths
+                          if not libexport.is_url(song_path)
+                          and os.path.isfile(song_path)]
+            if len(streams) + len(song_files) < len(paths):
+                print('\rSkipped %d missing songs.' % (
+                    len(paths) - len(streams) - len(song_files)))
+            return self._load_songs(song_files) + [
+                self._new_song(stream, ('', '', '', None, None))
+                for stream in streams]
+        songs = [self._new_song(song_file, record)
+                 for (song_file, record) in libexport.iter_library(path)]
+        print('\rImported %d songs.' % len(songs))
+        return songs
+
+    def export(self, path):
+        # writes playlist to path (by its extension, see libexport)
+        with self._profiler.span('export', path):
+            count = libexport.export(path, self._songs)
+        print('\rExported %d songs to %s' % (count, path))
 
     def repick_playlist(self):
         print('')
@@ -215,49 +700,302 @@ class Player(object):
         self._current = -1
         self._finish_song()
 
-    def _find_songs(self, dir_):
-        supported = ('mp3', 'ogg', 'flv', 'flac', 'webm', 'mp4')
-        songs = []
-        dirs = [dir_]
-        # print('searching for songs: 0')
-        for dir_ in dirs:
-            for sub in os.listdir(dir_):
-                pathname = os.path.join(dir_, sub.decode('utf-8', 'ignore'))
-                mode = os.stat(pathname)[stat.ST_MODE]
-                if stat.S_ISDIR(mode):
-                    dirs.append(pathname)
-                elif stat.S_ISREG(mode) and pathname.endswith(supported):
-                    songs.append(pathname)
-                print('\rfindings songs: {dirs} dirs, {files} files        '
-                      .format(dirs=len(dirs), files=len(songs)),
-                      end='')
+    def _new_walker(self):
+        return walker.SongWalker(
+            SONG_EXTENSIONS, IGNORED_NAMES, threads=self._scan_threads)
+
+    def _find_songs(self, dirs_, dirs=None):
+        # songs found in all dirs_ (appending scanned dirs to dirs)
+        if len(dirs_) == 1:
+            songs = self._walker.find_songs(dirs_[0], dirs)
+        else:
+            songs = []
+            for (_, found) in self._scanner.iter_songs(dirs_, dirs):
+                songs.extend(found)
         print('')
         return songs
 
+    def _load_snapshot(self, dir_):
+        lib = snapshot.load(snapshot.snapshot_path(dir_), dir_)
+        if lib is None or lib.use_tags != self.show_tags:
+            return None
+        self._library = lib
+        print('\rLoaded %d songs from snapshot.' % len(lib))
+        return list(lib)
+
+    def _save_snapshot(self, dir_, dirs):
+        try:
+            snapshot.save(
+                snapshot.snapshot_path(dir_), self._library, dir_, dirs)
+        except (IOError, OSError) as exc:
+            print('\rUnable to save snapshot: %s' % exc)
+
     def _load_songs(self, song_files):
         songs = []
         total = len(song_files)
-        for song_file in song_files:
-            songs.append(SongInfo(song_file, self.show_tags))
+        for song_file, record in self._load_records(song_files):
+            songs.append(self._new_song(song_file, record))
             print('\rloading songs: {cur}/{total}'
                   .format(cur=len(songs), total=total),
                   end='')
         print('')
+        if self._tag_cache is not None:
+            self._tag_cache.flush()
+            print('\r%s' % self._tag_cache.stats())
         return songs
 
-    def _select_artist(self, dir_):
-        subdirs = []
-        for sub in os.listdir(dir_):
-            pathname = os.path.join(dir_, sub)
-            if os.path.isdir(pathname):
-                subdirs.append(pathname)
-        if not subdirs:
-            return ''
-        return random.choice(subdirs)
+    def _new_song(self, song_file, record):
+        if self._library is not None:
+            return self._library.add(song_file, record)
+        return SongInfo(song_file, self.show_tags, record=record)
+
+    def _load_records(self, song_files):
+        # yields (song_file, record) in no particular order,
+        # records not found in tag cache are read by worker processes
+        cache = self._tag_cache
+        profiler = self._profiler
+        if self.jobs < 2 or len(song_files) < 2:
+            for song_file in song_files:
+                with profiler.span('tags', song_file):
+                    record = load_record(song_file, cache)
+                yield song_file, record
+            return
+
+        missing = []
+        missing_st = []
+        for song_file in song_files:
+            if cache is None:
+                missing.append(song_file)
+                continue
+            st = os.stat(song_file)
+            record = cache.get(song_file, st)
+            if record is None:
+                missing.append(song_file)
+                missing_st.append(st)
+            else:
+                yield song_file, record
+        if not missing:
+            return
+
+        # (no forking while mplayer is being started in other thread)
+        self._wait_for_mplayer()
+        pool = multiprocessing.Pool(self.jobs, _init_worker)
+        try:
+            chunksize = max(1, min(64, len(missing) // (self.jobs * 8)))
+            read = read_record_timed if profiler.enabled else read_record
+            records = pool.imap(read, missing, chunksize)
+            for idx, record in enumerate(records):
+                if profiler.enabled:
+                    (record, secs) = record
+                    profiler.record('tags', secs, missing[idx])
+                if cache is not None:
+                    cache.put(missing[idx], missing_st[idx], record)
+                yield missing[idx], record
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def _start_stream(self, dirs_):
+        self._stop_stream()
+        self._songs = playqueue.PlayQueue()
+        self._incoming = Queue()
+        self._stream_cancel = threading.Event()
+        self._stream_thread = threading.Thread(
+            target=self._stream_songs,
+            args=(dirs_, self._incoming, self._stream_cancel))
+        self._stream_thread.daemon = True
+        self._stream_thread.start()
+
+    def _stop_stream(self):
+        if self._stream_thread is None:
+            return
+        self._stream_cancel.set()
+        self._stream_thread.join()
+        self._stream_thread = None
+        self._incoming = None
+
+    def _stream_songs(self, dirs_, incoming, cancel):
+        # runs in background thread, songs are taken from incoming
+        # by _take_streamed (None marks end of stream) - songs
+        # of several dirs come mixed, as their scans find them
+        try:
+            for (_, song_files) in self._scanner.iter_songs(
+                    dirs_, cancel=cancel):
+                for song_file in song_files:
+                    if cancel.is_set():
+                        return
+                    with self._profiler.span('tags', song_file):
+                        record = load_record(song_file, self._tag_cache)
+                    incoming.put(self._new_song(song_file, record))
+        finally:
+            if self._tag_cache is not None:
+                self._tag_cache.flush()
+            incoming.put(None)
+
+    def _take_streamed(self, timeout=None):
+        # moves songs found meanwhile by _stream_songs into playlist,
+        # with timeout waits (at most timeout secs) for at least one
+        while self._incoming is not None:
+            try:
+                if timeout is None:
+                    song = self._incoming.get_nowait()
+                else:
+                    song = self._incoming.get(True, timeout)
+            except Empty:
+                return
+            timeout = None
+            if song is None:
+                # whole directory loaded
+                self._incoming = None
+                self._stream_thread = None
+                self._search_index.build_async()
+                return
+            self._enqueue(song)
+
+    def _enqueue(self, song):
+        # adds new song into not yet played part of playlist
+        self._songs.append(song)
+        self._search_index.add(song)
+        unplayed = max(0, self._current + 1)
+        if self._queued is not None:
+            unplayed += 1  # (next one is in mplayer's playlist already)
+        if self.shuffle and unplayed < len(self._songs) - 1:
+            # "inside-out" shuffle of the not yet played part
+            idx = random.randint(unplayed, len(self._songs) - 1)
+            self._songs.swap(idx, len(self._songs) - 1)
+        self._prefetch_next()
+
+    def _remove_song(self, idx):
+        if idx == self._current:
+            return  # being played, mplayer has it opened anyway
+        song = self._songs.pop(idx)
+        self._search_index.remove(song)
+        if idx < self._current:
+            self._current -= 1
+        if self._queued == song.path:
+            # (queued next song is gone - mplayer fails to open it
+            # and goes on with the one _queue_next queues after it)
+            self._queued = None
+        self._prefetch_next()
+
+    def _prefetch_next(self):
+        # songs after current one are going to be played next
+        if self._prefetcher is None:
+            return
+        start = self._current + 1
+        self._prefetcher.retarget(
+            song.path for song in self._songs[start:start + self.readahead])
+
+    def _song_index(self, path):
+        return self._songs.index_of(path)
+
+    def _start_watching(self, dirs_):
+        self._stop_watching()
+        self._watcher = watcher.watch(
+            dirs_, walker.SongWalker(SONG_EXTENSIONS, IGNORED_NAMES))
+        if self._watcher.fileno() is not None:
+            self._loop.add_reader(self._watcher, self._on_library_changes)
+        else:
+            self._poll_library(first=True)
+
+    def _stop_watching(self):
+        if self._watcher is None:
+            return
+        if self._watcher.fileno() is not None:
+            self._loop.remove_reader(self._watcher)
+        if self._watch_timer is not None:
+            self._watch_timer.cancel()
+            self._watch_timer = None
+        self._watcher.close()
+        self._watcher = None
+
+    def _poll_library(self, first=False):
+        if not first:
+            self._on_library_changes()
+        self._watch_timer = self._loop.call_later(
+            self._watcher.poll_interval, self._poll_library)
+
+    def _on_library_changes(self):
+        for (change, path) in self._watcher.read_changes():
+            if change == watcher.REMOVE_DIR:
+                prefix = os.path.join(path, '')
+                for idx in reversed(range(len(self._songs))):
+                    if self._songs[idx].path.startswith(prefix):
+                        self._remove_song(idx)
+                continue
+            idx = self._song_index(path)
+            if change == watcher.REMOVE:
+                if idx is not None:
+                    self._remove_song(idx)
+                continue
+            try:
+                song = self._new_song(
+                    path, load_record(path, self._tag_cache))
+            except Exception:
+                continue  # removed meanwhile, or not a song after all
+            if not self._matches_filter(song):
+                if idx is not None:
+                    self._remove_song(idx)  # (its tags changed)
+                continue
+            if idx is None:
+                self._enqueue(song)
+            else:
+                # rewritten (e.g. tags changed)
+                self._search_index.remove(self._songs[idx])
+                self._search_index.add(song)
+                self._songs[idx] = song
+
+    def _matches_filter(self, song):
+        # song of -f filter (any one when there is none)
+        if self.song_filter is None:
+            return True
+        return bool(searchindex.SearchIndex([song]).matches(
+            self.song_filter))
+
+    def _wait_for_song(self, keybd):
+        # next song of streamed playlist may be still on the way
+        while self.song is None and self._incoming is not None:
+            self._take_streamed(timeout=0.1)
+            if keybd is None:
+                self._loop.run_once(0)  # (control commands)
+            elif not keybd.process_keys():
+                self.stop()
+        return bool(self.song and self.song.path)
+
+    def _select_artist(self):
+        # (music dirs are listed only when they changed, see ArtistIndex)
+        return self._artist_index.pick()
 
     def play(self):
         self._current = 0
-        self._play_song()
+        try:
+            if self.daemon:
+                self._play_daemon()
+            else:
+                self._play_song()
+        finally:
+            if self._prefetcher is not None:
+                self._prefetcher.close()
+
+    def _play_daemon(self):
+        # plays (and repicks, when playlist ends) till stopped,
+        # controlled only through control socket
+        self._loop.add_signal_handler(signal.SIGTERM, self.stop)
+        print('\rListening on %s' % self._control.path)
+        try:
+            while True:
+                self._play_songs(None)
+                if self._stopped or not (self._songs or self._incoming):
+                    break
+                self._pick_playlist()
+                self._current = 0
+        finally:
+            self._loop.remove_signal_handler(signal.SIGTERM)
+            self._control.close()
+            self._clean_nowplaying()
 
     def _play_song(self):
         key_map = {
@@ -266,116 +1004,229 @@ class Player(object):
             '-': (self.volume_down,),
             '<': (self.jump_back5,),
             '>': (self.jump_fwd5,),
+            '<left>': (self.jump_back5,),
+            '<right>': (self.jump_fwd5,),
+            '<up>': (self.volume_up,),
+            '<down>': (self.volume_down,),
             'e': (self.jump_end,),
             'n': (self.next_song,),
             'p': (self.prev_song,),
             'i': (self.print_song_info,),
             'q': (self.stop,),
             'r': (self.reset_term,),
-            'P': (self._player.pause,),
-            ' ': (self._player.pause,),
-            'l': (self.list_songs,),
+            'P': (self._state.pause,),
+            ' ': (self._state.pause,),
             '~': (self.repick_playlist,),
             qsio.NonBlockingKeypress.KEY_INT: (self.stop,),
         }
-        with qsio.NonBlockingKeypress(key_map) as keybd:
+        with qsio.NonBlockingKeypress(
+                key_map, profiler=self._hot_profiler) as keybd:
             keybd.reg_key('/', self._start_search, pass_backref=True)
+            keybd.reg_key('l', self._start_list, pass_backref=True)
             keybd.reg_key('h', lambda: self._show_keybindings(keybd))
-
-            # whole playlist
-            p = self._player
-            while self.song and self.song.path:
-                print("%s\r" % (self.song), end='')
-                # FIXME(queria|later): ^^ what should be fixed here?
-                p.loadfile(self.song.path)
-                # wait till file is loaded
-                while p.paused is None:
-                    time.sleep(0.1)
-                _ = p.length  # noqa
-                # restore volume
-                if self._last_vol is None:
-                    self._last_vol = p.volume
-                p.volume = self._last_vol
-                # play file
-                if p.paused:
-                    p.pause()
-                self._report_nowplaying()
-                # whole song
-                while self._playing_sleep():
-                    if not keybd.process_keys():
-                        self.stop()
-                        break
-                self._current += 1
-                print('\r')
+            self._loop.add_reader(keybd, self._on_keys, keybd)
+            self._loop.add_signal_handler(signal.SIGWINCH, self._on_resize)
+            self._play_songs(keybd)
+            self._loop.remove_signal_handler(signal.SIGWINCH)
+            self._loop.remove_reader(keybd)
         self._clean_nowplaying()
 
-    def _playing_sleep(self):
-        if self._player.paused:
-            time.sleep(0.4)
+    def _play_songs(self, keybd):
+        # whole playlist (keybd is None in daemon mode)
+        p = self._state
+        while self._wait_for_song(keybd):
+            self._status.render(self._status.fit(unicode(self.song)))
+            if self._prefetcher is not None:
+                self._prefetcher.played(self.song.path)
+            self._load_song()
+            self._prefetch_next()
+            _ = p.length  # noqa
+            # restore volume
+            if self._last_vol is None:
+                self._last_vol = p.volume
+            p.volume = self._last_vol
+            # play file
+            if p.paused:
+                p.pause()
+            self._report_nowplaying(force=True)
+            # whole song
+            self._song_done = False
+            self._update_status()
+            while not self._song_done:
+                self._loop.run_once()
+            self._current += 1
+            if self._listing is None:
+                # (listing is redrawn in place, line has to stay)
+                print('\r')
+            self._status.invalidate()
+
+    def _load_song(self):
+        # wait till file is loaded - 'Starting playback' from mplayer,
+        # or pause property being available in case message won't come
+        # (keys are handled meanwhile)
+        self._loading = True
+        if self._queued is not None and self._queued == self.song.path:
+            # mplayer continues with it by itself (and it may be
+            # loaded already, _song_loaded was reset by EOF)
+            self._state.invalidate()
         else:
-            time.sleep(0.1)
+            self._song_loaded = False
+            self._state.loadfile(self.song.path)
+        self._queued = None
+        while not self._song_loaded and self._state.paused is None:
+            self._loop.run_once(STATUS_INTERVAL)
+            self._state.invalidate()
+        self._loading = False
+
+    def _on_player_output(self, line):
+        # called from mplayer's output reader thread
+        self._loop.call_soon_threadsafe(self._player_event, line)
+
+    def _player_event(self, line):
+        if line.startswith('Starting playback'):
+            self._song_loaded = True
+        elif line.startswith('EOF code:') and self._song_loaded:
+            # (EOF of previous song, arriving while next one
+            # is being loaded, is ignored)
+            self._song_loaded = False
+            self._song_done = True
+
+    def _queue_next(self):
+        # appends next song to mplayer's playlist shortly before
+        # current one ends (later than sooner, as it can't be taken
+        # back when playlist changes meanwhile)
+        if self._queued is not None or self._loading:
+            return
+        if self._current + 1 >= len(self._songs):
+            return
+        (length, time_pos) = (self._state.length, self._state.time_pos)
+        if length is None or time_pos is None:
+            return
+        if length - time_pos > GAPLESS_AHEAD:
+            return
+        self._queued = self._songs[self._current + 1].path
+        self._state.loadfile(self._queued, append=True)
+
+    def _on_keys(self, keybd):
+        if not keybd.process_keys():
+            self.stop()
+        # (key actions may have printed something over status line)
+        self._status.invalidate()
+        if not self._loading:
+            # (status of loaded song is shown when loading finishes)
+            self._update_status()
+
+    def _update_status(self):
+        with self._profiler.span('tick'):
+            self._status_tick()
+
+    def _status_tick(self):
+        # redraws status line and plans next redraw, unless paused
+        # (then nothing changes till next key press)
+        # - or sooner, when status line refused too frequent redraw
+        if self._status_timer is not None:
+            self._status_timer.cancel()
+            self._status_timer = None
+        self._take_streamed()
+        self._state.tick()
+        if not self._show_status():
+            self._song_done = True
+            return
+        if self.gapless:
+            self._queue_next()
+        self._report_nowplaying()
+        interval = STATUS_INTERVAL
+        if self._status.pending is not None:
+            interval = min(interval, self._status.delay())
+        elif self._searching is None and self._state.paused:
+            return
+        self._status_timer = self._loop.call_later(
+            interval, self._update_status)
+
+    def _show_status(self):
+        if self._listing is not None and self._listing.render(self._current):
+            self._status.invalidate()
         if self._searching is not None:
             if self._search_changed:
-                search_msg = 'search: %s  => %s (%s)' % (
+                found = '...'  # (being searched)
+                if self._search_count is not None:
+                    found = '%d found' % self._search_count
+                hit_pos = ''
+                hits = [self._search_hit]
+                if self._search_hits:
+                    # (selected one first, followed by next best ones)
+                    idx = self._search_hits.index(self._search_hit)
+                    hits = self._search_hits[idx:] + self._search_hits[:idx]
+                    hit_pos = '[%d/%d] ' % (idx + 1, len(hits))
+                search_msg = 'search: %s  (%s) => %s%s' % (
                     self._searching,
-                    self._search_hit.path,
-                    self._search_hit)
-                search_msg = search_msg.ljust(self._cols - 1)
+                    found,
+                    hit_pos,
+                    ' | '.join('%s' % hit for hit in hits))
                 # self._search_changed = False
-                # FIXME(queria): update has to be done twice
-                # doing just one print() is for some reason
-                # (not clear to me now) not enough, and screen
-                # updated is delayed by one key press
-                # - on "first" look it's not related to
-                #   qsio/playing_sleep loop
-                #   more like to stdout/console update
-                # - adding print('x') before this print
-                #   does not helped!
-                print('%s\r' % search_msg, end='')
+                self._status.render(self._status.fit(search_msg))
             return True
-        if self._changed or self._player.percent_pos is None:
+        if self._changed or self._state.percent_pos is None:
             self._changed = False
             return False
-        paused = 'PAUSED' if self._player.paused else ''
-        msg_format = "[%d/%d] %s %s%% %s"
+        paused = 'PAUSED' if self._state.paused else ''
+        msg_format = "[%d/%s] %s %s%% %s"
+        total = str(len(self._songs))
+        if self._incoming is not None:
+            total += '+'  # still growing
         try:
             msg_data = (
                 self._current + 1,
-                len(self._songs),
+                total,
                 unicode(self.song),
-                self.song.percent_pos(self._player.time_pos),
+                self.song.percent_pos(self._state.time_pos),
                 paused)
         except UnicodeEncodeError as exc:
             msg_data = (
                 self._current + 1,
-                len(self._songs),
+                total,
                 str(exc),
-                self.song.percent_pos(self._player.time_pos),
+                self.song.percent_pos(self._state.time_pos),
                 paused)
         msg = msg_format % msg_data
-        vol = '[vol=%s%%]' % sround(self._player.volume)
-
-        msg_max_len = self._cols - len(vol) - 1
-        if len(msg) > msg_max_len:
-            msg = msg[:msg_max_len]
-        print("%s%s\r" % (msg.ljust(msg_max_len), vol), end='')
+        vol = '[vol=%s%%]' % sround(self._state.volume)
+        self._status.render(self._status.fit(msg, vol))
         return True
 
     def _start_search(self, keybd):
         print('\n')
         self._searching = ''
+        self._search_count = 0
+        self._searcher = searchindex.IncrementalSearch(
+            self._search_index, self._loop, self._on_search_result,
+            self.search_limit)
         keybd.passthrough(self._update_search)
         self._search_changed = True
 
     def _update_search(self, keybd, char):
         if char is None:
             return
-        if ord(char) == 13:  # enter
+        if char in ('<up>', '<down>'):  # previous/next of best hits
+            if self._search_hits:
+                self._search_changed = True
+                idx = self._search_hits.index(self._search_hit)
+                idx += 1 if char == '<down>' else -1
+                self._search_hit = self._search_hits[
+                    idx % len(self._search_hits)]
+        elif len(char) > 1:  # other special keys
+            return
+        elif ord(char) == 13:  # enter
             wanted = self._search_hit
             self._stop_search(keybd)
             self.jump_to_name(wanted.path, move_in_queue=True)
+        elif ord(char) == 1:  # ctrl+a
+            wanted = self._search_index.matches(self._searching)
+            self._stop_search(keybd)
+            self.play_next([song.path for song in wanted])
         elif ord(char) == 27:  # escape
             self._stop_search(keybd)
+        elif ord(char) == 9:  # tab
+            self._update_search(keybd, '<down>')
         else:
             self._search_changed = True
             if ord(char) == 127:  # backspace
@@ -383,16 +1234,73 @@ class Player(object):
             else:
                 self._searching += char
             self._searching = self._searching.lower()
-            self._search_hit = self._no_song
-            for song in self._songs:
-                if song.has_substr(self._searching):
-                    self._search_hit = song
-                    break
+            # (hits of previous query are shown till it's searched)
+            self._search_count = None
+            self._searcher.search(self._searching)
+
+    def _on_search_result(self, query, count, hits):
+        if query != self._searching:
+            return  # (search ended or other query typed meanwhile)
+        self._search_count = count
+        self._search_hits = hits
+        self._search_hit = hits[0] if hits else self._no_song
+        if not self._loading:
+            self._update_status()
 
     def _stop_search(self, keybd):
+        self._close_searcher()
         self._search_changed = True
         self._searching = None
         self._search_hit = self._no_song
+        self._search_hits = []
+        keybd.passthrough(None)
+
+    def _close_searcher(self):
+        if self._searcher is not None:
+            self._searcher.close()
+            self._searcher = None
+
+    def _start_list(self, keybd):
+        print('\n')
+        self._listing = listview.ListView(self._songs, self._search_index)
+        self._listing.show(max(0, self._current))
+        keybd.passthrough(self._update_list)
+
+    def _update_list(self, keybd, char):
+        if char is None:
+            return
+        listing = self._listing
+        moves = {
+            '<up>': -1,
+            '<down>': 1,
+            '<pageup>': -listing.rows,
+            '<pagedown>': listing.rows,
+        }
+        if char in moves:
+            listing.move(moves[char])
+        elif char == '<home>':
+            listing.move_to(0)
+        elif char == '<end>':
+            listing.move_to(len(listing) - 1)
+        elif len(char) > 1:  # other special keys
+            return
+        elif ord(char) == 13:  # enter
+            wanted = listing.position()
+            self._stop_list(keybd)
+            if wanted is not None:
+                self.jump_to(wanted)
+        elif ord(char) == 27:  # escape
+            self._stop_list(keybd)
+        elif ord(char) == 9:  # tab
+            listing.show(max(0, self._current))
+        elif ord(char) == 127:  # backspace
+            listing.set_filter(listing.filter[:-1])
+        else:
+            listing.set_filter(listing.filter + char.lower())
+
+    def _stop_list(self, keybd):
+        self._listing.close()
+        self._listing = None
         keybd.passthrough(None)
 
     def _show_keybindings(self, keybd):
@@ -435,16 +1343,16 @@ class Player(object):
         return info
 
     def volume_up(self):
-        self._player.volume = min(
+        self._state.volume = min(
             100,
-            self._player.volume + self.volume_diff)
-        self._last_vol = self._player.volume
+            self._state.volume + self.volume_diff)
+        self._last_vol = self._state.volume
 
     def volume_down(self):
-        self._player.volume = max(
+        self._state.volume = max(
             0,
-            self._player.volume - self.volume_diff)
-        self._last_vol = self._player.volume
+            self._state.volume - self.volume_diff)
+        self._last_vol = self._state.volume
 
     def next_song(self):
         if self._current + 1 == len(self._songs):
@@ -456,6 +1364,9 @@ class Player(object):
         self._finish_song()
 
     def stop(self):
+        self._stopped = True
+        self._stop_stream()
+        self._stop_watching()
         self._current = len(self._songs)
         self._finish_song()
 
@@ -463,15 +1374,16 @@ class Player(object):
         if index < 0 or index >= len(self._songs):
             print('invalid index')
             return False
-        if move_in_queue:
+        if move_in_queue and index != self._current:
             # move the 'index' song
             # just behing current one
-            self._songs.insert(
-                self._current + 1,
-                self._songs.pop(index))
+            # (current one shifts when it was before it)
+            self._current = self._songs.move_after(
+                self._current, [self._songs[index].path])
         else:
             # just jump to position
             # before 'index' song
+            # (current one is played again when chosen)
             self._current = index - 1
         # as finish_song will move one next after current
         self._finish_song()
@@ -480,22 +1392,31 @@ class Player(object):
     def jump_to_name(self, song_name, move_in_queue=False):
         if not song_name:
             return False
-        for idx, song in enumerate(self._songs):
-            if song_name == song.path:
-                return self.jump_to(idx, move_in_queue)
-        return False
+        idx = self._song_index(song_name)
+        if idx is None:
+            return False
+        return self.jump_to(idx, move_in_queue)
+
+    def play_next(self, song_names):
+        # moves songs (by path) right after current one, keeping
+        # their order, and starts the first of them
+        if not song_names:
+            return False
+        self._current = self._songs.move_after(self._current, song_names)
+        self._finish_song()
+        return True
 
     def jump_end(self):
         try:
-            self._player.time_pos = self._player.length - 10
+            self._state.time_pos = self._state.length - 10
         except TypeError:
             pass  # weird float error in mplayer.py?
 
     def jump_time(self, steptime=0, stepcount=1):
         try:
             while stepcount > 0:
-                self._player.time_pos = max(
-                    0.0, self._player.time_pos + steptime)
+                self._state.time_pos = max(
+                    0.0, self._state.time_pos + steptime)
                 stepcount -= 1
         except TypeError as exc:
             print('Ouch: %s', exc)
@@ -507,50 +1428,245 @@ class Player(object):
         self.jump_time(steptime=-5, stepcount=1)
 
     def reset_term(self):
-        self._cols = self._term_cols()
+        self._status.resize()
+        if self._listing is not None:
+            self._listing.resize()
+
+    def _on_resize(self):
+        self.reset_term()
+        if not self._loading and not self._song_done:
+            self._update_status()
 
     def _finish_song(self):
+        if self._queued is not None:
+            # (mplayer would continue with the queued song, which may
+            # not be the wanted one - stop drops it from its playlist)
+            self._queued = None
+            self._state.stop()
         try:
-            self._player.time_pos = self._player.length
+            self._state.time_pos = self._state.length
         except TypeError:
             pass  # weird float error in mplayer.py?
         self._changed = True
+        self._prefetch_next()
 
     def print_song_info(self):
         print('\r')
-        if self._player.metadata:
-            md = self._player.metadata
+        if self._state.metadata:
+            md = self._state.metadata
             for k, v in md.iteritems():
                 print(' %s: %s\r' % (k, v))
-        if self._player.length is not None:
+        if self._state.length is not None:
             print(' length: %s\r' % self.song.length)
             print(' length_perc: %s\r' % self.song.percent_pos(1, raw=True))
-            print(' current_pos: %s\r' % self._player.time_pos)
+            print(' current_pos: %s\r' % self._state.time_pos)
         print('file: %s\r' % self.song.path)
+        print(' %s\r' % self._state.stats())
+        print(' status: %d frames written, %d unchanged skipped\r' % (
+            self._status.frames, self._status.skipped))
+        if self._prefetcher is not None:
+            print(' %s\r' % self._prefetcher.stats())
 
     def list_songs(self, printout=True):
+        # (interactively 'l' shows paged listing, see _start_list)
         if not printout:
             return self._songs
         print('')
-        print('\n\r'.join([
-            ('%s (%s)%s' % (
+        current = self.song
+        for s in self._songs:
+            print('%s (%s)%s\r' % (
                 s.path,
                 s,
-                ' <================' if s == self.song else ''
-            ))
-            for s in self._songs]))
+                ' <================' if s == current else ''))
         print('\n\r', end='')
 
-    def _term_cols(self):
-        (rows, cols) = subprocess.check_output(['stty', 'size']).split()
-        return int(cols)
+    def _control_commands(self):
+        # commands of control socket (daemon mode), see control.py
+        return {
+            'status': lambda _: self._control_status(),
+            'next': lambda _: self.next_song(),
+            'prev': lambda _: self.prev_song(),
+            'pause': lambda _: self._state.pause(),
+            'stop': lambda _: self.stop(),
+            'repick': lambda _: self.repick_playlist(),
+            'volume': self._control_volume,
+            'jump': lambda path: self._control_jump(path, False),
+            'play_next': lambda path: self._control_jump(path, True),
+            'search': self._control_search,
+            'list': self._control_list,
+        }
 
-    def _report_nowplaying(self):
-        with open(os.path.expanduser('~/.nowplaying'), 'w') as np_file:
-            np_file.write(unicode(self.song).encode('utf-8'))
+    def _on_command(self):
+        # (like after key press)
+        if not self._loading and self.song is not None:
+            self._update_status()
+
+    def _song_info(self, idx, song):
+        return {'index': idx, 'path': song.path, 'title': '%s' % song}
+
+    def _control_status(self):
+        status = {
+            'total': len(self._songs),
+            'loading': self._incoming is not None,
+            'paused': self._state.paused,
+            'time_pos': self._state.time_pos,
+            'length': self._state.length,
+            'volume': self._state.volume,
+            'song': None,
+        }
+        if self.song is not None:
+            status['song'] = self._song_info(self._current, self.song)
+        return status
+
+    def _control_volume(self, volume):
+        if volume is None:
+            return self._state.volume
+        if self._state.volume is None:
+            raise control.ControlError('nothing is playing')
+        if volume[0] in '+-':
+            volume = self._state.volume + int(volume)
+        self._state.volume = max(0, min(100, int(volume)))
+        self._last_vol = self._state.volume
+        return self._last_vol
+
+    def _control_jump(self, path, move_in_queue):
+        if not self.jump_to_name(path, move_in_queue):
+            raise control.ControlError('no such song %r' % path)
+
+    def _control_search(self, query):
+        return [self._song_info(self._song_index(song.path), song)
+                for song in self._search_index.search(
+                    query or '', self.search_limit)]
+
+    def _control_list(self, argument):
+        # 'START [COUNT]' (from current song by default)
+        args = (argument or '').split()
+        start = int(args[0]) if args else max(0, self._current)
+        count = min(int(args[1]) if len(args) > 1 else 20, 1000)
+        return [self._song_info(idx, self._songs[idx])
+                for idx in range(max(0, start),
+                                 min(len(self._songs), start + count))]
+
+    def _report_nowplaying(self, force=False):
+        if self._nowplaying is None:
+            self._nowplaying = nowplaying.NowPlaying(
+                min_interval=NOWPLAYING_INTERVAL)
+        self._nowplaying.update(
+            unicode(self.song), self.song.path, self._current,
+            len(self._songs), self._state.time_pos, self._state.length,
+            self._state.volume, self._state.paused, force)
 
     def _clean_nowplaying(self):
-        os.remove(os.path.expanduser('~/.nowplaying'))
+        if self._nowplaying is not None:
+            self._nowplaying.clear()
+            self._nowplaying.close()
+            self._nowplaying = None
+
+
+class Remote(object):
+    # Terminal client of daemon (play.py --attach) - keys are sent
+    # as commands through control socket (see Player._control_commands)
+    # and status line shows what the daemon plays.
+    REFRESH = 0.5  # secs between status queries
+
+    def __init__(self, socket_path=None):
+        self._client = control.ControlClient(socket_path)
+        self._loop = eventloop.EventLoop()
+        self._status = statusline.StatusLine()
+        self._attached = False
+
+    def run(self):
+        key_map = {
+            'n': (lambda: self._call('next'),),
+            'p': (lambda: self._call('prev'),),
+            '=': (lambda: self._call('volume', '+5'),),
+            '+': (lambda: self._call('volume', '+5'),),
+            '-': (lambda: self._call('volume', '-5'),),
+            '<up>': (lambda: self._call('volume', '+5'),),
+            '<down>': (lambda: self._call('volume', '-5'),),
+            ' ': (lambda: self._call('pause'),),
+            'P': (lambda: self._call('pause'),),
+            '~': (lambda: self._call('repick'),),
+            's': (self.stop,),
+            'q': (self.detach,),
+            qsio.NonBlockingKeypress.KEY_INT: (self.detach,),
+        }
+        self._attached = True
+        with qsio.NonBlockingKeypress(key_map) as keybd:
+            self._loop.add_reader(keybd, self._on_keys, keybd)
+            self._refresh()
+            while self._attached:
+                self._loop.run_once()
+            self._loop.remove_reader(keybd)
+        self._client.close()
+        print('\r')
+
+    def stop(self):
+        self._call('stop')
+        self.detach()
+
+    def detach(self):
+        self._attached = False
+
+    def _on_keys(self, keybd):
+        if not keybd.process_keys():
+            self.detach()
+
+    def _call(self, name, argument=None):
+        try:
+            self._client.call(name, argument)
+        except control.ControlError as exc:
+            self._status.render(self._status.fit('%s: %s' % (name, exc)))
+            return
+        except IOError:
+            self.detach()  # (daemon is gone)
+            return
+        self._show_status()
+
+    def _refresh(self):
+        if self._attached:
+            self._show_status()
+            self._loop.call_later(self.REFRESH, self._refresh)
+
+    def _show_status(self):
+        try:
+            status = self._client.call('status')
+        except (control.ControlError, IOError):
+            self.detach()
+            return
+        song = status['song']
+        if song is None:
+            self._status.render(self._status.fit('[-/%d]' % status['total']))
+            return
+        percent = 0
+        if status['length'] and status['time_pos'] is not None:
+            percent = int(round(100 * status['time_pos'] / status['length']))
+        msg = '[%d/%d%s] %s %s%% %s' % (
+            song['index'] + 1,
+            status['total'],
+            '+' if status['loading'] else '',
+            song['title'],
+            percent,
+            'PAUSED' if status['paused'] else '')
+        vol = '[vol=%s%%]' % sround(status['volume'])
+        self._status.render(self._status.fit(msg, vol))
+
+
+def send(socket_path, args):
+    # sends command (name and argument) to daemon, prints its result
+    try:
+        with control.ControlClient(socket_path) as client:
+            result = client.call(args[0], ' '.join(args[1:]) or None)
+    except control.ControlError as exc:
+        print('** Error: ', exc)
+        sys.exit(1)
+    except IOError as exc:
+        # (socket errors - refused, stale socket, no answer in time)
+        print('** Error: ', '%s (%s)' % (
+            exc, control.socket_path(socket_path)))
+        sys.exit(1)
+    if result is not None:
+        print(json.dumps(result, indent=2))
 
 
 def main():
@@ -561,19 +1677,86 @@ def main():
         help()
     if opts['man']:
         man()
-    music_dir = opts['music_dir']
-    if not music_dir:
-        music_dir = DEFAULT_COLLECTION
-    if not os.path.isdir(music_dir):
-        usage(1, "Music directory ({}) doesn't exists!\n".format(music_dir))
-
-    p = Player(
-        os.path.abspath(music_dir),
-        exact_folder=bool(opts['exact']),
-        shuffle=(not bool(opts['sorted'])),
-        show_tags=(not bool(opts['notags'])),
-    )
-    p.play()
+    if opts['send']:
+        send(opts['socket'], opts['send'])
+        return
+    if opts['nowplaying']:
+        print(json.dumps(nowplaying.read(), indent=2))
+        return
+    if opts['attach']:
+        try:
+            Remote(opts['socket']).run()
+        except control.ControlError as exc:
+            usage(1, '%s' % exc)
+        except IOError as exc:
+            usage(1, '%s (%s)' % (exc, control.socket_path(opts['socket'])))
+        return
+    if opts['import'] is not None and not os.path.isfile(opts['import']):
+        usage(1, "File to import ({}) doesn't exists!\n".format(
+            opts['import']))
+    music_dirs = opts['music_dirs'] or DEFAULT_COLLECTION
+    for music_dir in music_dirs:
+        if opts['import'] is None and not os.path.isdir(music_dir):
+            usage(1, "Music directory ({}) doesn't exists!\n".format(
+                music_dir))
+    music_dirs = [os.path.abspath(music_dir) for music_dir in music_dirs]
+    # (exporting needs neither mplayer nor control socket)
+    daemon = bool(opts['daemon']) and opts['export'] is None
+    if daemon:
+        try:
+            control.check_free(opts['socket'])
+        except control.ControlError as exc:
+            usage(1, '%s' % exc)
+
+    profiler = None
+    if opts['profile']:
+        profiler = profiling.Profiler(opts['profile_dump'])
+
+    cache = None
+    artists_path = None
+    if not opts['nocache']:
+        cache = tagcache.TagCache(refresh=bool(opts['refresh']))
+        artists_path = artistindex.DEFAULT_PATH
+    artists = artistindex.ArtistIndex(
+        music_dirs, artists_path, weight=opts['weight'])
+
+    try:
+        p = Player(
+            music_dirs,
+            exact_folder=bool(opts['exact']),
+            shuffle=(not bool(opts['sorted'])),
+            show_tags=(not bool(opts['notags'])),
+            tag_cache=cache,
+            jobs=opts['jobs'],
+            scan_threads=opts['threads'],
+            stream=bool(opts['stream']),
+            compact=bool(opts['compact']),
+            watch=bool(opts['watch']),
+            readahead=opts['readahead'],
+            gapless=bool(opts['gapless']),
+            profiler=profiler,
+            fast=bool(opts['fast']),
+            artist_index=artists,
+            device_scans=opts['device_scans'],
+            device_limits=opts['device_limits'],
+            daemon=daemon,
+            socket=opts['socket'],
+            import_path=opts['import'],
+            song_filter=opts['filter'],
+            limit=opts['limit'],
+            playing=opts['export'] is None,
+        )
+        if opts['export'] is not None:
+            p.export(opts['export'])
+        else:
+            p.play()
+    finally:
+        if cache is not None:
+            cache.close()
+        artists.close()
+        if profiler is not None:
+            profiler.close()
+            print('\r%s' % profiler.summary().replace('\n', '\n\r'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,187 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import time
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+
+def _flag(value):
+    return value == 'yes'
+
+
+# property => conversion of mplayer's answer
+PROPERTIES = (
+    ('pause', _flag),
+    ('percent_pos', int),
+    ('time_pos', float),
+    ('volume', float),
+    ('length', float),
+)
+
+
+class PlayerState(object):
+    # Snapshot of mplayer (mplayer.Player) properties.
+    #
+    # refresh() asks for all PROPERTIES at once - commands are written
+    # in one go and answers (coming in the same order) read afterwards,
+    # so one tick costs one round trip instead of one per property read.
+    # Reads are served from the snapshot (refreshed on demand after
+    # invalidate()), writes go to mplayer and update the snapshot too.
+    #
+    # ipc_* counters: round trips (and secs spent in them) for
+    # the last tick and in total, see stats()
+    # profiler: profiling.Profiler recording each round trip (as 'ipc')
+    timeout = 1.0  # secs to wait for answers
+
+    def __init__(self, player, profiler=None):
+        self._player = player
+        self._profiler = profiler
+        self._values = None
+        self.ticks = 0
+        self.ipc_calls = 0
+        self.ipc_time = 0.0
+        self.tick_calls = 0
+        self.tick_time = 0.0
+
+    def tick(self):
+        # start of new tick, snapshot is refreshed
+        self.ticks += 1
+        self.tick_calls = 0
+        self.tick_time = 0.0
+        self.refresh()
+
+    def invalidate(self):
+        self._values = None
+
+    def refresh(self):
+        start = time.time()
+        self._values = dict(zip(
+            [name for (name, _) in PROPERTIES],
+            self._get_properties(PROPERTIES)))
+        self._count_ipc(time.time() - start)
+
+    def _get_properties(self, properties):
+        player = self._player
+        if not player.is_alive():
+            return [None] * len(properties)
+        answers = player._stdout._answers
+        self._write(''.join(
+            '%s get_property %s\n' % (player.cmd_prefix, name)
+            for (name, _) in properties))
+        values = []
+        deadline = time.time() + self.timeout
+        for (name, convert) in properties:
+            key = 'ANS_%s=' % name
+            value = None
+            while True:
+                try:
+                    res = answers.get(
+                        timeout=max(0, deadline - time.time()))
+                except Empty:
+                    # (rest of answers is late, or won't come at all)
+                    return values + [None] * (len(properties) - len(values))
+                if res.startswith(key) or res.startswith('ANS_ERROR='):
+                    break
+                # otherwise stale answer of some earlier timed out request
+            if res.startswith(key):
+                value = res.partition('=')[2].strip('\'"')
+                value = None if value == '(null)' else convert(value)
+            values.append(value)
+        return values
+
+    def _write(self, cmd):
+        stdin = self._player._proc.stdin
+        try:
+            stdin.write(cmd)
+        except (TypeError, UnicodeEncodeError):
+            stdin.write(cmd.encode('utf-8', 'ignore'))
+        stdin.flush()
+
+    def _count_ipc(self, secs):
+        self.ipc_calls += 1
+        self.ipc_time += secs
+        self.tick_calls += 1
+        self.tick_time += secs
+        if self._profiler is not None:
+            self._profiler.record('ipc', secs)
+
+    def _get(self, name):
+        if self._values is None:
+            self.refresh()
+        return self._values[name]
+
+    def _set(self, name, value):
+        start = time.time()
+        setattr(self._player, name, value)  # (mplayer.py checks type/range)
+        self._count_ipc(time.time() - start)
+        if self._values is not None:
+            self._values[name] = value
+        return value
+
+    @property
+    def paused(self):
+        return self._get('pause')
+
+    @property
+    def percent_pos(self):
+        return self._get('percent_pos')
+
+    @property
+    def time_pos(self):
+        return self._get('time_pos')
+
+    @time_pos.setter
+    def time_pos(self, value):
+        self._set('time_pos', value)
+        if self._values is not None:
+            self._values['percent_pos'] = None  # unknown till refresh
+
+    @property
+    def volume(self):
+        return self._get('volume')
+
+    @volume.setter
+    def volume(self, value):
+        self._set('volume', value)
+
+    @property
+    def length(self):
+        return self._get('length')
+
+    @property
+    def metadata(self):
+        return self._player.metadata
+
+    def pause(self):
+        start = time.time()
+        self._player.pause()
+        self._count_ipc(time.time() - start)
+        if self._values is not None and self._values['pause'] is not None:
+            self._values['pause'] = not self._values['pause']
+
+    def loadfile(self, path, append=False):
+        # append: add to mplayer's playlist, to be played after current
+        if append:
+            self._player.loadfile(path, 1)
+            return
+        self._player.loadfile(path)
+        self.invalidate()
+
+    def stop(self):
+        # stops playback, dropping rest of mplayer's playlist
+        self._player.stop()
+        self.invalidate()
+
+    def stats(self):
+        if not self.ticks:
+            return 'ipc: no ticks yet'
+        return ('ipc: last tick {calls} calls ({ms:.1f} ms),'
+                ' avg {avg_calls:.1f} calls ({avg_ms:.1f} ms) per tick'
+                .format(calls=self.tick_calls,
+                        ms=self.tick_time * 1000,
+                        avg_calls=float(self.ipc_calls) / self.ticks,
+                        avg_ms=self.ipc_time * 1000 / self.ticks))
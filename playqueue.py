@@ -0,0 +1,216 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from bisect import bisect_right
+
+BLOCK = 512  # songs per block (at most)
+
+
+class PlayQueue(object):
+    # Playlist - sequence of songs (objects with unique .path) kept in
+    # blocks of up to BLOCK songs, with index of path => block (built
+    # on first lookup by path, so paths aren't read before needed).
+    #
+    # Indexing costs O(log blocks), insert/pop O(BLOCK + blocks)
+    # instead of moving whole list, position of path (index_of)
+    # is found without scanning the playlist and move_after()
+    # moves any number of songs in one pass.
+    def __init__(self, songs=()):
+        self._blocks = []
+        self._block_of = None  # path => block (list) holding the song
+        self._starts = None  # index of first song of each block
+        self._numbers = None  # id(block) => its position in _blocks
+        self._len = 0
+        self.extend(songs)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for block in self._blocks:
+            for song in block:
+                yield song
+
+    def __contains__(self, song):
+        return self._paths().get(song.path) is not None
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._len))]
+        (block, offset) = self._locate(idx)
+        return block[offset]
+
+    def __setitem__(self, idx, song):
+        (block, offset) = self._locate(idx)
+        self._forget(block[offset], block)
+        block[offset] = song
+        self._place([song], block)
+
+    def get(self, path):
+        # song of given path (or None)
+        block = self._paths().get(path)
+        if block is None:
+            return None
+        for song in block:
+            if song.path == path:
+                return song
+
+    def index_of(self, path):
+        # position of song with given path (or None)
+        block = self._paths().get(path)
+        if block is None:
+            return None
+        self._index_blocks()
+        start = self._starts[self._numbers[id(block)]]
+        for (offset, song) in enumerate(block):
+            if song.path == path:
+                return start + offset
+
+    def append(self, song):
+        if not self._blocks or len(self._blocks[-1]) >= BLOCK:
+            self._blocks.append([])
+            self._changed()
+        self._blocks[-1].append(song)
+        self._place([song], self._blocks[-1])
+        self._len += 1  # (starts of blocks are still valid)
+
+    def extend(self, songs):
+        for song in songs:
+            self.append(song)
+        self._changed()
+
+    def insert(self, idx, song):
+        self.insert_many(idx, [song])
+
+    def insert_many(self, idx, songs):
+        # inserts songs (in given order) before position idx
+        if not songs:
+            return
+        idx = max(0, min(self._len, idx if idx >= 0 else self._len + idx))
+        if idx == self._len:
+            number = len(self._blocks)
+        else:
+            (block, offset) = self._locate(idx)
+            number = self._numbers[id(block)]
+            if offset:
+                # split, so songs go in between
+                tail = block[offset:]
+                del block[offset:]
+                self._blocks.insert(number + 1, tail)
+                self._place(tail, tail)
+                number += 1
+        new_blocks = [list(songs[i:i + BLOCK])
+                      for i in range(0, len(songs), BLOCK)]
+        self._blocks[number:number] = new_blocks
+        for block in new_blocks:
+            self._place(block, block)
+        self._len += len(songs)
+        self._changed()
+        self._merge_small(number + len(new_blocks))
+        self._merge_small(number)
+
+    def pop(self, idx=-1):
+        (block, offset) = self._locate(idx)
+        song = block.pop(offset)
+        self._forget(song, block)
+        self._len -= 1
+        if not block:
+            del self._blocks[self._numbers[id(block)]]
+        self._changed()
+        return song
+
+    def remove(self, path):
+        # removes (and returns) song of given path, if any
+        idx = self.index_of(path)
+        if idx is None:
+            return None
+        return self.pop(idx)
+
+    def swap(self, idx1, idx2):
+        (block1, offset1) = self._locate(idx1)
+        (block2, offset2) = self._locate(idx2)
+        (block1[offset1], block2[offset2]) = (block2[offset2],
+                                              block1[offset1])
+        self._place([block1[offset1]], block1)
+        self._place([block2[offset2]], block2)
+
+    def move_after(self, anchor, paths):
+        # moves songs of given paths (in given order, unknown ones
+        # skipped) right after position anchor (-1 => to the start),
+        # returns new position of the song which was at anchor
+        moving = []
+        seen = set()
+        anchor_path = self[anchor].path if anchor >= 0 else None
+        for path in paths:
+            if path in seen or path == anchor_path:
+                continue
+            idx = self.index_of(path)
+            if idx is None:
+                continue
+            seen.add(path)
+            moving.append(self.pop(idx))
+            if idx < anchor:
+                anchor -= 1
+        self.insert_many(anchor + 1, moving)
+        return anchor
+
+    def _locate(self, idx):
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError('playlist index out of range')
+        self._index_blocks()
+        number = bisect_right(self._starts, idx) - 1
+        return (self._blocks[number], idx - self._starts[number])
+
+    def _index_blocks(self):
+        if self._starts is not None:
+            return
+        starts = []
+        numbers = {}
+        pos = 0
+        for (number, block) in enumerate(self._blocks):
+            starts.append(pos)
+            numbers[id(block)] = number
+            pos += len(block)
+        self._starts = starts
+        self._numbers = numbers
+
+    def _changed(self):
+        self._starts = None
+        self._numbers = None
+
+    def _paths(self):
+        if self._block_of is None:
+            self._block_of = {}
+            for block in self._blocks:
+                for song in block:
+                    self._block_of[song.path] = block
+        return self._block_of
+
+    def _place(self, songs, block):
+        # notes block holding songs (once paths are indexed)
+        if self._block_of is None:
+            return
+        for song in songs:
+            self._block_of[song.path] = block
+
+    def _forget(self, song, block):
+        if self._block_of is None:
+            return
+        if self._block_of.get(song.path) is block:
+            del self._block_of[song.path]
+
+    def _merge_small(self, number):
+        # merges block at number into the previous one, if they are
+        # small enough together (keeps blocks from fragmenting)
+        if not 0 < number < len(self._blocks):
+            return
+        (prev, block) = (self._blocks[number - 1], self._blocks[number])
+        if len(prev) + len(block) > BLOCK:
+            return
+        prev.extend(block)
+        self._place(block, prev)
+        del self._blocks[number]
+        self._changed()
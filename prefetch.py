@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import os
+import threading
+
+DEFAULT_BUDGET = 32 * 1024 * 1024  # bytes warmed ahead at most
+CHUNK = 1024 * 1024
+
+
+def _warm_fadvise(fileobj, size):
+    os.posix_fadvise(fileobj.fileno(), 0, size, os.POSIX_FADV_WILLNEED)
+
+
+def _warm_read(fileobj, size):
+    while size > 0:
+        data = fileobj.read(min(CHUNK, size))
+        if not data:
+            break
+        size -= len(data)
+
+
+class Prefetcher(object):
+    # Warms page cache with the beginning of songs which are going
+    # to be played next, so loading them does not wait for (slow,
+    # spinning or network) disk. Done in background thread by
+    # posix_fadvise(WILLNEED) where available, by reading otherwise.
+    #
+    # retarget(paths) sets upcoming songs (nearest first), each one
+    # gets as much of budget as is left after the previous ones.
+    # played(path) tells which song is being loaded - counts hits
+    # (song was warmed), late (warming not finished yet) and misses.
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.hits = 0
+        self.late = 0
+        self.misses = 0
+        self.warmed_bytes = 0
+        self._warmed = {}  # path => bytes warmed
+        self._targets = []
+        self._cond = threading.Condition()
+        self._closed = False
+        if hasattr(os, 'posix_fadvise'):
+            self._warm = _warm_fadvise
+        else:
+            self._warm = _warm_read
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def retarget(self, paths):
+        with self._cond:
+            paths = list(paths)
+            if paths == self._targets:
+                return
+            self._targets = paths
+            # forget songs not wanted anymore (cache may drop them)
+            for path in list(self._warmed):
+                if path not in paths:
+                    del self._warmed[path]
+            self._cond.notify()
+
+    def played(self, path):
+        with self._cond:
+            if path in self._warmed:
+                self.hits += 1
+            elif path in self._targets:
+                self.late += 1
+            else:
+                self.misses += 1
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def stats(self):
+        total = self.hits + self.late + self.misses
+        return ('prefetch: %d hits, %d late, %d misses (%.0f%% hit rate),'
+                ' %.1f MiB warmed' % (
+                    self.hits, self.late, self.misses,
+                    100.0 * self.hits / total if total else 0,
+                    self.warmed_bytes / 1048576.0))
+
+    def _next_target(self):
+        # (path, bytes to warm) or None when budget is used up
+        left = self.budget
+        for path in self._targets:
+            if left <= 0:
+                break
+            if path in self._warmed:
+                left -= self._warmed[path]
+                continue
+            return (path, left)
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                target = self._next_target()
+                while target is None and not self._closed:
+                    self._cond.wait()
+                    target = self._next_target()
+                if self._closed:
+                    return
+            (path, size) = target
+            warmed = 0
+            try:
+                with open(path, 'rb') as fileobj:
+                    warmed = min(size, os.fstat(fileobj.fileno()).st_size)
+                    self._warm(fileobj, warmed)
+            except (IOError, OSError):
+                pass  # (loading will tell what is wrong with it)
+            with self._cond:
+                if path in self._targets:
+                    self._warmed[path] = warmed
+                    self.warmed_bytes += warmed
@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import heapq
+import json
+import os
+import threading
+import time
+
+MAX_EVENTS = 100000  # spans kept for JSON trace
+SLOWEST = 10  # slowest details (e.g. files) listed per span name
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+
+class NullProfiler(object):
+    # used when profiling is off - does nothing, as cheaply as possible
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, name, detail=None):
+        return self._span
+
+    def record(self, name, secs, detail=None, start=None):
+        pass
+
+    def summary(self):
+        return ''
+
+    def close(self):
+        pass
+
+
+class _Span(object):
+    def __init__(self, profiler, name, detail):
+        self._profiler = profiler
+        self._name = name
+        self._detail = detail
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self._profiler.record(self._name, time.time() - self._start,
+                              self._detail, self._start)
+        return False
+
+
+class Profiler(object):
+    # Collects timing spans: count/total/max per span name, slowest
+    # spans with details (e.g. which file it was) and, for JSON trace,
+    # the spans themselves (in chrome://tracing format).
+    #
+    # dump: file to write on close() - JSON trace when it ends
+    #   with '.json', cProfile stats (of main thread) otherwise
+    enabled = True
+
+    def __init__(self, dump=None):
+        self._dump = dump
+        self._lock = threading.Lock()
+        self._stats = {}    # name => [count, total, max]
+        self._slowest = {}  # name => heap of (secs, detail)
+        self._events = []
+        self._started = time.time()
+        self._cprofile = None
+        if dump is not None and not dump.endswith('.json'):
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def span(self, name, detail=None):
+        return _Span(self, name, detail)
+
+    def record(self, name, secs, detail=None, start=None):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += secs
+            stats[2] = max(stats[2], secs)
+            if detail is not None:
+                slowest = self._slowest.setdefault(name, [])
+                if len(slowest) < SLOWEST:
+                    heapq.heappush(slowest, (secs, detail))
+                elif secs > slowest[0][0]:
+                    heapq.heapreplace(slowest, (secs, detail))
+            if self._dump is not None and len(self._events) < MAX_EVENTS:
+                if start is None:
+                    start = time.time() - secs
+                thread = threading.current_thread().name
+                self._events.append((name, start, secs, detail, thread))
+
+    def summary(self):
+        lines = ['profile (%.1fs):' % (time.time() - self._started),
+                 '  %-12s %8s %10s %10s %10s' % (
+                     'span', 'count', 'total ms', 'avg ms', 'max ms')]
+        with self._lock:
+            for name in sorted(self._stats,
+                               key=lambda n: -self._stats[n][1]):
+                (count, total, max_) = self._stats[name]
+                lines.append('  %-12s %8d %10.1f %10.3f %10.3f' % (
+                    name, count, total * 1000,
+                    total * 1000 / count, max_ * 1000))
+            for name in sorted(self._slowest):
+                lines.append('  slowest %s:' % name)
+                for (secs, detail) in sorted(self._slowest[name],
+                                             reverse=True):
+                    lines.append('    %8.1f ms  %s' % (secs * 1000, detail))
+        return '\n'.join(lines)
+
+    def close(self):
+        if self._dump is None:
+            return
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._dump)
+            return
+        with open(self._dump, 'w') as dump_file:
+            json.dump({'traceEvents': self._trace_events()}, dump_file)
+
+    def _trace_events(self):
+        pid = os.getpid()
+        events = []
+        for (name, start, secs, detail, thread) in self._events:
+            event = {
+                'name': name,
+                'ph': 'X',
+                'ts': int((start - self._started) * 1e6),
+                'dur': int(secs * 1e6),
+                'pid': pid,
+                'tid': thread,
+            }
+            if detail is not None:
+                event['args'] = {'detail': '%s' % detail}
+            events.append(event)
+        return events
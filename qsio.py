@@ -3,17 +3,139 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 from Queue import Queue, Empty
+from collections import deque
+import codecs
+import errno
+import fcntl
+import os
+import select
 import sys
 import termios
 from threading import Thread
 import tty
 
 
+# escape sequences of special keys => names passed instead of them
+ESCAPE_KEYS = {
+    '\x1b[A': '<up>', '\x1bOA': '<up>',
+    '\x1b[B': '<down>', '\x1bOB': '<down>',
+    '\x1b[C': '<right>', '\x1bOC': '<right>',
+    '\x1b[D': '<left>', '\x1bOD': '<left>',
+    '\x1b[H': '<home>', '\x1bOH': '<home>', '\x1b[1~': '<home>',
+    '\x1b[F': '<end>', '\x1bOF': '<end>', '\x1b[4~': '<end>',
+    '\x1b[2~': '<insert>', '\x1b[3~': '<delete>',
+    '\x1b[5~': '<pageup>', '\x1b[6~': '<pagedown>',
+    '\x1bOP': '<f1>', '\x1bOQ': '<f2>', '\x1bOR': '<f3>', '\x1bOS': '<f4>',
+    '\x1b[11~': '<f1>', '\x1b[12~': '<f2>',
+    '\x1b[13~': '<f3>', '\x1b[14~': '<f4>',
+    '\x1b[15~': '<f5>', '\x1b[17~': '<f6>',
+    '\x1b[18~': '<f7>', '\x1b[19~': '<f8>',
+    '\x1b[20~': '<f9>', '\x1b[21~': '<f10>',
+    '\x1b[23~': '<f11>', '\x1b[24~': '<f12>',
+}
+# secs to wait for the rest of escape sequence split between reads
+# (e.g. over ssh), ESC not followed by it by then is ESC key itself
+ESC_TIMEOUT = 0.1
+
+
+def split_keys(text):
+    # splits text into keys, escape sequences (ESC O x, ESC [ ... final)
+    # being one key (named by ESCAPE_KEYS, if known)
+    # returns (keys, rest) - rest is unfinished sequence at the end
+    # (or ESC alone, which may start one)
+    keys = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        nxt = text[i + 1:i + 2]
+        if char == '\x1b' and not nxt:
+            return keys, text[i:]
+        if char != '\x1b' or nxt not in ('O', '['):
+            # also lone ESC, or ESC + key (alt+key) as two keys
+            keys.append(char)
+            i += 1
+            continue
+        end = i + 2
+        if nxt == '[':
+            # parameters/intermediates till final byte (@ - ~)
+            while end < len(text) and not '@' <= text[end] <= '~':
+                end += 1
+        if end >= len(text):
+            return keys, text[i:]
+        seq = text[i:end + 1]
+        keys.append(ESCAPE_KEYS.get(seq, seq))
+        i = end + 1
+    return keys, ''
+
+
+class SelectReadChar(object):
+    # Reads whatever is available on source's fd at once (no thread),
+    # fileno() can be waited on by select/event loops.
+    # ^c and ^d end the input (closed is set once prior keys are read).
+    def __init__(self, source):
+        self.source = source
+        self.closed = False
+        self._fd = source.fileno()
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self._keys = deque()
+        self._eof = False
+
+    def fileno(self):
+        return self._fd
+
+    def readchar(self):
+        if not self._keys and not self._eof:
+            self._read_keys()
+        if not self._keys:
+            return None
+        key = self._keys.popleft()
+        if key is None:
+            self.closed = True
+        return key
+
+    def _read_keys(self):
+        if not select.select([self._fd], [], [], 0)[0]:
+            return
+        keys = []
+        rest = ''
+        while True:
+            data = os.read(self._fd, 1024)
+            new_keys, rest = split_keys(rest + self._decoder.decode(data))
+            keys.extend(new_keys)
+            if not data or not rest:
+                break
+            # (rest of escape sequence should follow shortly, unless
+            # keys were pressed like that, e.g. ESC alone)
+            if not select.select([self._fd], [], [], ESC_TIMEOUT)[0]:
+                break
+        keys.extend(rest)
+        for key in keys:
+            if key == '\x03':  # ^c
+                print('\n\r[ Interrupted ]')
+                self._end()
+                break
+            if key == '\x04':  # eof
+                self._end()
+                break
+            self._keys.append(key)
+        if not data and not self._eof:
+            self._end()
+
+    def _end(self):
+        self._keys.append(None)
+        self._eof = True
+
+
 class NonBlockingReadChar:
     def __init__(self, source):
         self.queue = Queue()
         self.source = source
         self.closed = False
+        # reader thread writes to this pipe after each queued char,
+        # so event loops can wait on fileno() instead of polling
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        flags = fcntl.fcntl(self._wakeup_r, fcntl.F_GETFL)
+        fcntl.fcntl(self._wakeup_r, fcntl.F_SETFL, flags | os.O_NONBLOCK)
         self.t = Thread(target=self.__read_chars)
         self.t.daemon = True
         self.t.start()
@@ -26,8 +148,24 @@ class NonBlockingReadChar:
                 return None
             return char
         except Empty:
+            self.__drain_wakeups()
             return None
 
+    def fileno(self):
+        return self._wakeup_r
+
+    def __drain_wakeups(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except OSError as exc:
+            if exc.errno != errno.EAGAIN:
+                raise
+
+    def __put(self, char):
+        self.queue.put(char)
+        os.write(self._wakeup_w, b'x')
+
     def __read_char(self):
         return self.source.read(1)
 
@@ -38,16 +176,17 @@ class NonBlockingReadChar:
                 break
             if ord(ch) == 4:  # eof
                 break
-            self.queue.put(ch)
+            self.__put(ch)
         self.source.close()
-        self.queue.put('')
+        self.__put('')
 
 
 class NonBlockingKeypress(object):
     KEY_INT = 3
     KEY_EOF = 4
 
-    def __init__(self, keymap=None, pass_keys=False, source=None):
+    def __init__(self, keymap=None, pass_keys=False, source=None,
+                 threaded=False, profiler=None):
         # keymap example:
         #   key = 'a'
         #   key2 = 'b'
@@ -59,10 +198,18 @@ class NonBlockingKeypress(object):
         # pass_keys: bool, if True pass pressed key as first arg to callback,
         #   can be also specified per each key-action mapping via reg_key()
         # source: file like object, defaults to sys.stdin (should be/have tty?)
+        # threaded: read source by NonBlockingReadChar (one char at time
+        #   in thread) instead of SelectReadChar
+        # special keys (arrows, function keys, ...) are passed as names
+        #   like '<up>' or '<f1>', see ESCAPE_KEYS
+        # profiler: profiling.Profiler to record time spent in callbacks
         if source is None:
             source = sys.stdin
 
         self._keymap = {}
+        self._source = source
+        self._threaded = threaded
+        self._profiler = profiler
         self._pass_keys = pass_keys
         self._input_fd = source.fileno()
         self._input_attrs = termios.tcgetattr(self._input_fd)
@@ -78,12 +225,19 @@ class NonBlockingKeypress(object):
         new_attr = termios.tcgetattr(self._input_fd)
         new_attr[3] = new_attr[3] & ~termios.ECHO
         termios.tcsetattr(self._input_fd, termios.TCSANOW, new_attr)
-        self._input = NonBlockingReadChar(sys.stdin)
+        if self._threaded:
+            self._input = NonBlockingReadChar(self._source)
+        else:
+            self._input = SelectReadChar(self._source)
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
         termios.tcsetattr(self._input_fd, termios.TCSADRAIN, self._input_attrs)
 
+    def fileno(self):
+        # becomes readable when there are keys to process
+        return self._input.fileno()
+
     def unreg_key(self, key):
         try:
             return self._keymap.pop(key)
@@ -121,8 +275,10 @@ class NonBlockingKeypress(object):
             if c is None:
                 break
             if self._passthrough is not None:
+                # (all keys read at once go to it, unless it is
+                # switched off meanwhile, e.g. by enter)
                 self._call(self._passthrough, c)
-                break
+                continue
             elif c in self._keymap:
                 for action in self._keymap[c]:
                     self._call(action, c)
@@ -141,7 +297,11 @@ class NonBlockingKeypress(object):
             args.append(self)
         if passkey:
             args.append(char)
-        action['callback'](*args)
+        if self._profiler is None:
+            action['callback'](*args)
+            return
+        with self._profiler.span('key', repr(char)):
+            action['callback'](*args)
 
 if __name__ == '__main__':
     import time
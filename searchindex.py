@@ -0,0 +1,378 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from array import array
+import heapq
+import itertools
+import threading
+
+
+CANCEL_CHECK = 1024  # songs matched between checks of cancel event
+GRAM = 3  # longest n-grams indexed (shorter ones are too, for short terms)
+# n-grams found in more than COMMON of indexed songs (once there are
+# COMMON_MIN of them) are not indexed anymore, they would not narrow
+# any search (e.g. those of music dir all paths start with)
+COMMON = 0.5
+COMMON_MIN = 10000
+# field scopes usable in queries as 'field:term',
+# mapped to song attribute and weight used for ranking
+FIELDS = {
+    'title': ('title', 4),
+    'artist': ('artist', 3),
+    'album': ('album', 2),
+    'file': ('filename', 1),
+    'path': ('path', 1),
+}
+# position of field's text in texts of song (search_text is first)
+FIELD_TEXT = dict((name, idx + 1) for (idx, name) in enumerate(FIELDS))
+# (position of text, weight) of all fields, the heaviest first
+BY_WEIGHT = sorted([(FIELD_TEXT[name], weight)
+                    for (name, (_, weight)) in FIELDS.items()],
+                   key=lambda field: -field[1])
+
+
+def ngrams(text, size=GRAM):
+    return set([text[i:i + size] for i in range(len(text) - size + 1)])
+
+
+class SearchIndex(object):
+    # N-gram index over songs (SongInfo like objects, having
+    # search_text and attributes named in FIELDS).
+    #
+    # Songs themselves (not their positions in playlist) are indexed,
+    # so reordering of playlist does not affect the index,
+    # only adding/removing songs has to be reported.
+    #
+    # Adding songs is cheap, their n-grams (of 1 to GRAM characters,
+    # of search_text and of fields) are computed by build() (usually
+    # running in background thread, see build_async), songs not yet
+    # built are searched by plain scan meanwhile. Lowercased texts
+    # of songs are kept, so they are not lowercased on each search.
+    # Terms having only too common n-grams (see COMMON) are searched
+    # by plain scan too. All matches are ranked (scoring is linear,
+    # only the best ones are kept by heap).
+    #
+    # query: whitespace separated terms, all have to match,
+    #   term can be scoped to one field like 'artist:abba'
+    #
+    # version is increased whenever songs are added or removed
+    # (so results kept by callers can be told to be outdated).
+    def __init__(self, songs=()):
+        self.version = 0
+        self._songs = []       # song id => song (None when removed)
+        self._texts = []       # song id => its texts (None till needed)
+        self._ids = {}         # song => song id
+        self._postings = {}    # n-gram => array of song ids
+        self._pending = []     # song ids not yet in postings
+        self._common = set()   # n-grams too common to be indexed
+        self._built = 0        # songs indexed
+        self._lock = threading.Lock()
+        for song in songs:
+            self.add(song)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, song):
+        with self._lock:
+            if song in self._ids:
+                return
+            self.version += 1
+            song_id = len(self._songs)
+            self._songs.append(song)
+            self._texts.append(None)
+            self._ids[song] = song_id
+            self._pending.append(song_id)
+
+    def remove(self, song):
+        with self._lock:
+            song_id = self._ids.pop(song, None)
+            if song_id is not None:
+                self.version += 1
+                # postings keep the id, it's skipped when searching
+                self._songs[song_id] = None
+                self._texts[song_id] = None
+
+    def build(self, chunk=64):
+        # index pending songs, lock is released after each chunk
+        # so searches are not blocked for long
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._build(self._pending[:chunk])
+                del self._pending[:chunk]
+
+    def build_async(self):
+        builder = threading.Thread(target=self.build)
+        builder.daemon = True
+        builder.start()
+        return builder
+
+    def search(self, query, limit=10):
+        # returns up to limit best matching songs
+        terms = self._parse(query.lower())
+        if not terms:
+            return []
+        return self._rank(self._find(terms), terms, limit)
+
+    def rank(self, songs, query, limit=10, cancel=None):
+        # returns up to limit best matching of songs (matches of query),
+        # None when cancel (threading.Event) got set meanwhile
+        terms = self._parse(query.lower())
+        return self._rank(songs, terms, limit, cancel)
+
+    def matches(self, query, songs=None, cancel=None):
+        # returns all matching songs (not ranked), of songs only when
+        # given (e.g. matches of query this one narrows, see narrows),
+        # None when cancel (threading.Event) got set meanwhile
+        terms = self._parse(query.lower())
+        if not terms:
+            return []
+        if songs is None:
+            return self._find(terms, cancel=cancel)
+        found = []
+        for (idx, song) in enumerate(songs):
+            if (cancel is not None and not idx % CANCEL_CHECK and
+                    cancel.is_set()):
+                return None
+            song_id = self._ids.get(song)
+            if song_id is not None and self._matches(
+                    self._song_texts(song_id, song), terms):
+                found.append(song)
+        return found
+
+    def narrows(self, query, narrower):
+        # True when all matches of narrower query match query too
+        # (every term of query is part of some term of narrower
+        # in the same field - e.g. narrower got typed after query)
+        terms = self._parse(query.lower())
+        if not terms:
+            return False
+        narrower_terms = self._parse(narrower.lower())
+        for (field, term) in terms:
+            for (narrower_field, narrower_term) in narrower_terms:
+                if field == narrower_field and term in narrower_term:
+                    break
+            else:
+                return False
+        return True
+
+    def _find(self, terms, cancel=None):
+        # (lock is held only while candidates are taken, so songs
+        # can be added/removed/built while they are being matched -
+        # removed ones are skipped)
+        with self._lock:
+            candidates = self._candidates(terms)
+        found = []
+        for (idx, song_id) in enumerate(candidates):
+            if (cancel is not None and not idx % CANCEL_CHECK and
+                    cancel.is_set()):
+                return None
+            song = self._songs[song_id]
+            if song is not None and self._matches(
+                    self._song_texts(song_id, song), terms):
+                found.append(song)
+        return found
+
+    def _rank(self, matches, terms, limit, cancel=None):
+        # (each term with fields it's scored by)
+        scopes = []
+        for (field, term) in terms:
+            if field is None:
+                scopes.append((term, BY_WEIGHT, 1))
+            else:
+                scopes.append(
+                    (term, [(FIELD_TEXT[field], FIELDS[field][1])], 0))
+        ranked = []
+        for (idx, song) in enumerate(matches):
+            if (cancel is not None and not idx % CANCEL_CHECK and
+                    cancel.is_set()):
+                return None
+            song_id = self._ids.get(song)
+            if song_id is None:
+                continue  # (removed meanwhile)
+            texts = self._song_texts(song_id, song)
+            ranked.append((-self._score(texts, scopes), len(texts[0]), idx))
+        return [matches[idx]
+                for (_, _, idx) in heapq.nsmallest(limit, ranked)]
+
+    def _parse(self, query):
+        terms = []
+        for word in query.split():
+            field = None
+            if ':' in word:
+                name, term = word.split(':', 1)
+                if name in FIELDS:
+                    field, word = name, term
+            if word:
+                terms.append((field, word))
+        return terms
+
+    def _song_texts(self, song_id, song):
+        # search_text and lowercased fields (by FIELD_TEXT) of song
+        texts = self._texts[song_id]
+        if texts is None:
+            texts = [song.search_text] + [None] * len(FIELDS)
+            for (name, (attr, _)) in FIELDS.items():
+                texts[FIELD_TEXT[name]] = (
+                    getattr(song, attr, None) or '').lower()
+            texts = self._texts[song_id] = tuple(texts)
+        return texts
+
+    def _build(self, song_ids):
+        postings = self._postings
+        common = self._common
+        for song_id in song_ids:
+            song = self._songs[song_id]
+            if song is None:
+                continue
+            self._built += 1
+            most = None
+            if self._built >= COMMON_MIN:
+                most = int(self._built * COMMON)
+            texts = self._song_texts(song_id, song)
+            # (fields are usually part of search_text, but not always -
+            # e.g. artist of song without title)
+            text = '\n'.join([texts[0]] + [
+                field_text for field_text in texts[1:]
+                if field_text not in texts[0]])
+            grams = set()
+            for size in range(1, GRAM + 1):
+                grams.update(ngrams(text, size))
+            for gram in grams:
+                if gram in common:
+                    continue
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('i')
+                posting.append(song_id)
+                if most is not None and len(posting) > most:
+                    common.add(gram)
+                    del postings[gram]
+
+    def _candidates(self, terms):
+        # ids of the shortest posting among all n-grams of terms
+        # (every match has to be in it, but not vice versa)
+        # followed by all not yet indexed songs - copied, so they can
+        # be iterated without lock
+        best = None
+        for (_, term) in terms:
+            for gram in ngrams(term, min(GRAM, len(term))):
+                if gram in self._common:
+                    continue
+                posting = self._postings.get(gram, ())
+                if best is None or len(posting) < len(best):
+                    best = posting
+        if best is None:
+            # (all n-grams of terms are too common to be indexed)
+            return itertools.islice(itertools.count(), len(self._songs))
+        return itertools.chain(best[:], self._pending[:])
+
+    def _matches(self, texts, terms):
+        for (field, term) in terms:
+            if field is None:
+                text = texts[0]
+            else:
+                text = texts[FIELD_TEXT[field]]
+            if term not in text:
+                return False
+        return True
+
+    def _score(self, texts, scopes):
+        # sum of best weights of fields terms are in, doubled for
+        # matches at the start of words (fields are tried from the
+        # heaviest one, until none of the rest could score more)
+        score = 0
+        for (term, fields, best) in scopes:
+            for (text_idx, weight) in fields:
+                if best >= 2 * weight:
+                    break
+                text = texts[text_idx]
+                pos = text.find(term)
+                if pos < 0:
+                    continue
+                if pos == 0 or not text[pos - 1].isalnum():
+                    weight *= 2
+                if weight > best:
+                    best = weight
+            score += best
+        return score
+
+
+class IncrementalSearch(object):
+    # Search as you type, done by background thread, so slow searches
+    # hold up neither event loop nor next keys.
+    #
+    # Matches of previous queries are kept on stack - query narrowing
+    # the last one (e.g. character typed) only filters its matches,
+    # query that was searched already (e.g. after backspace) reuses
+    # them. Query still being searched when newer one comes is
+    # cancelled.
+    #
+    # index: SearchIndex searched
+    # loop: eventloop.EventLoop on_result(query, count, hits) is called
+    #   in - count of all matches, hits are up to limit best of them
+    def __init__(self, index, loop, on_result, limit=10):
+        self.index = index
+        self.limit = limit
+        self._loop = loop
+        self._on_result = on_result
+        self._stack = []       # (query, matches), each narrowing previous
+        self._version = None   # index version matches on stack are of
+        self._query = None     # query waiting for worker
+        self._cancel = threading.Event()
+        self._closed = False
+        self._wakeup = threading.Condition()
+        self._worker = threading.Thread(target=self._run)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def search(self, query):
+        with self._wakeup:
+            self._cancel.set()  # (of the one being searched, if any)
+            self._cancel = threading.Event()
+            self._query = query
+            self._wakeup.notify()
+
+    def close(self):
+        with self._wakeup:
+            self._closed = True
+            self._cancel.set()
+            self._wakeup.notify()
+
+    def _run(self):
+        # runs in background thread
+        while True:
+            with self._wakeup:
+                while self._query is None and not self._closed:
+                    self._wakeup.wait()
+                if self._closed:
+                    return
+                (query, cancel) = (self._query, self._cancel)
+                self._query = None
+            matches = self._matches(query, cancel)
+            if matches is None:
+                continue  # (cancelled)
+            hits = self.index.rank(matches, query, self.limit, cancel)
+            if hits is None:
+                continue  # (cancelled)
+            self._loop.call_soon_threadsafe(
+                self._on_result, query, len(matches), hits)
+
+    def _matches(self, query, cancel):
+        if self._version != self.index.version:
+            self._stack = []  # (songs were added or removed)
+            self._version = self.index.version
+        while self._stack and self._stack[-1][0] != query:
+            if self.index.narrows(self._stack[-1][0], query):
+                break
+            self._stack.pop()
+        if self._stack and self._stack[-1][0] == query:
+            return self._stack[-1][1]
+        songs = self._stack[-1][1] if self._stack else None
+        matches = self.index.matches(query, songs, cancel)
+        if matches is not None:
+            self._stack.append((query, matches))
+        return matches
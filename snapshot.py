@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from array import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+import library
+import walker
+
+DEFAULT_DIR = '~/.cache/play/snapshots'
+MAGIC = b'PLAYSNAP'
+VERSION = 1
+
+# magic, version, byte order (0 little, 1 big), use_tags, number of
+# sections; then for each section: type (b's' texts or array typecode),
+# number of texts, offset, length
+# texts are stored as (number of texts + 1) offsets (uint32)
+# and utf-8 data
+HEADER = struct.Struct('<8sIBBI')
+SECTION = struct.Struct('<cQQQ')
+
+# library.Library.COLUMNS + root dir and scanned dirs with their mtimes
+# (snapshot is valid as long as none of the dirs changed)
+TEXTS = ('names', 'files', 'titles', 'root', 'checked_dirs')
+ARRAYS = {'dirs': 'i', 'artists': 'i', 'albums': 'i',
+          'lengths': 'd', 'bitrates': 'i', 'checked_mtimes': 'd'}
+SECTIONS = (('root', 'checked_dirs', 'checked_mtimes') +
+            library.Library.COLUMNS)
+
+
+def snapshot_path(root, dir_=DEFAULT_DIR):
+    root = walker.unicode_path(root)
+    name = hashlib.sha1(root.encode('utf-8')).hexdigest()
+    return os.path.join(os.path.expanduser(dir_), name + '.snap')
+
+
+def _tobytes(arr):
+    if hasattr(arr, 'tobytes'):
+        return arr.tobytes()
+    return arr.tostring()
+
+
+def _frombytes(typecode, data):
+    arr = array(str(typecode))
+    if hasattr(arr, 'frombytes'):
+        arr.frombytes(data)
+    else:
+        arr.fromstring(data)
+    return arr
+
+
+class MappedTexts(object):
+    # sequence of texts stored (utf-8, one after another) in mapped
+    # buffer, decoded when accessed - texts appended later are kept
+    # in memory
+    def __init__(self, buf, start, offsets):
+        self._buf = buf
+        self._start = start
+        self._offsets = offsets  # (one more than there are texts)
+        self._mapped = len(offsets) - 1
+        self._added = []
+
+    def __len__(self):
+        return self._mapped + len(self._added)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if idx >= self._mapped:
+            return self._added[idx - self._mapped]
+        start = self._start + self._offsets[idx]
+        end = self._start + self._offsets[idx + 1]
+        return self._buf[start:end].decode('utf-8')
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def append(self, text):
+        self._added.append(text)
+
+
+def _pack_texts(texts):
+    # (offsets, blob)
+    offsets = array(str('I'), [0])
+    data = []
+    pos = 0
+    for text in texts:
+        encoded = text.encode('utf-8')
+        data.append(encoded)
+        pos += len(encoded)
+        offsets.append(pos)
+    return _tobytes(offsets) + b''.join(data)
+
+
+def _dir_mtime(dir_):
+    try:
+        return os.stat(dir_).st_mtime
+    except OSError:
+        return -1.0
+
+
+def save(path, lib, root, checked_dirs):
+    # writes library.Library lib of songs found in root, snapshot is
+    # invalidated when any of checked_dirs changes (or disappears)
+    columns = lib.columns()
+    columns['root'] = [walker.unicode_path(root)]
+    columns['checked_dirs'] = checked_dirs
+    columns['checked_mtimes'] = array(
+        str('d'), [_dir_mtime(dir_) for dir_ in checked_dirs])
+    sections = []
+    for name in SECTIONS:
+        if name in TEXTS:
+            sections.append((b's', len(columns[name]),
+                             _pack_texts(columns[name])))
+        else:
+            sections.append((ARRAYS[name].encode('ascii'), 0,
+                             _tobytes(columns[name])))
+    header = HEADER.pack(MAGIC, VERSION, int(sys.byteorder == 'big'),
+                         int(lib.use_tags), len(sections))
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    for (kind, count, data) in sections:
+        table.append(SECTION.pack(kind, count, offset, len(data)))
+        offset += len(data)
+
+    dir_ = os.path.dirname(path)
+    if not os.path.isdir(dir_):
+        os.makedirs(dir_)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as snap_file:
+        snap_file.write(header)
+        snap_file.write(b''.join(table))
+        for (_, _, data) in sections:
+            snap_file.write(data)
+    os.rename(tmp_path, path)
+
+
+def load(path, root):
+    # library.Library of songs in root, or None when there's no
+    # (valid, up to date) snapshot
+    try:
+        with open(path, 'rb') as snap_file:
+            buf = mmap.mmap(snap_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        columns = _read_sections(buf)
+    except (struct.error, ValueError, IndexError, UnicodeDecodeError):
+        columns = None
+    if columns is None or columns['root'][0] != walker.unicode_path(root):
+        buf.close()
+        return None
+    for (dir_, mtime) in zip(columns['checked_dirs'],
+                             columns['checked_mtimes']):
+        if _dir_mtime(dir_) != mtime:
+            buf.close()
+            return None
+    # (buf stays mapped as long as texts are referenced)
+    columns['names'] = list(columns['names'])
+    return library.Library.from_columns(columns['use_tags'], columns)
+
+
+def _read_sections(buf):
+    (magic, version, big_endian, use_tags, count) = HEADER.unpack_from(buf)
+    if (magic != MAGIC or version != VERSION or
+            big_endian != int(sys.byteorder == 'big') or
+            count != len(SECTIONS)):
+        return None
+    columns = {'use_tags': bool(use_tags)}
+    for (idx, name) in enumerate(SECTIONS):
+        (kind, count, offset, length) = SECTION.unpack_from(
+            buf, HEADER.size + SECTION.size * idx)
+        if offset + length > len(buf):
+            return None
+        if name in TEXTS:
+            if kind != b's':
+                return None
+            texts_start = offset + 4 * (count + 1)
+            columns[name] = MappedTexts(
+                buf, texts_start, _frombytes('I', buf[offset:texts_start]))
+        else:
+            if kind != ARRAYS[name].encode('ascii'):
+                return None
+            columns[name] = _frombytes(ARRAYS[name],
+                                       buf[offset:offset + length])
+    return columns
@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import fcntl
+import os
+import struct
+import sys
+import termios
+import time
+
+DEFAULT_SIZE = (24, 80)  # (rows, cols) when terminal won't tell
+
+
+def terminal_size(fd=None):
+    # (rows, cols) of terminal on fd (stdout by default)
+    if fd is None:
+        fd = sys.stdout.fileno()
+    try:
+        (rows, cols, _, _) = struct.unpack(
+            'hhhh', fcntl.ioctl(fd, termios.TIOCGWINSZ, b'\0' * 8))
+    except (IOError, OSError):
+        rows = cols = 0
+    if not cols:
+        try:
+            cols = int(os.environ.get('COLUMNS', ''))
+        except ValueError:
+            cols = DEFAULT_SIZE[1]
+    return (rows or DEFAULT_SIZE[0], cols)
+
+
+class StatusLine(object):
+    # Single line status renderer - remembers last frame and writes
+    # (and flushes) only when it differs, at most once per min_interval
+    # secs. Frame which came too early is kept as pending, caller
+    # should render again after delay() secs.
+    #
+    # Anything else printed to the stream breaks the remembered frame,
+    # invalidate() makes next render() write it out again.
+    # resize() re-reads terminal width (call it on SIGWINCH).
+    def __init__(self, stream=None, min_interval=1 / 30.0):
+        self._stream = stream if stream is not None else sys.stdout
+        self.min_interval = min_interval
+        self.cols = DEFAULT_SIZE[1]
+        self.pending = None
+        self.frames = 0   # frames written
+        self.skipped = 0  # frames same as previous one
+        self._last = None
+        self._last_time = 0
+        self.resize()
+
+    def resize(self):
+        try:
+            fd = self._stream.fileno()
+        except (AttributeError, ValueError, IOError):
+            fd = None
+        if fd is not None:
+            (_, self.cols) = terminal_size(fd)
+        self.invalidate()
+
+    def invalidate(self):
+        self._last = None
+
+    def delay(self):
+        # secs till next frame can be written
+        return max(0, self._last_time + self.min_interval - time.time())
+
+    def fit(self, text, right=''):
+        # text padded/cut to fill the line, with right aligned suffix
+        width = self.cols - len(right) - 1
+        return text[:width].ljust(width) + right
+
+    def render(self, text):
+        # returns True if frame was written out
+        self.pending = None
+        if text == self._last:
+            self.skipped += 1
+            return False
+        if self.delay() > 0:
+            self.pending = text
+            return False
+        print('%s\r' % text, end='', file=self._stream)
+        self._stream.flush()
+        self._last = text
+        self._last_time = time.time()
+        self.frames += 1
+        return True
@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_PATH = '~/.cache/play/tags.sqlite'
+DEFAULT_MAX_ENTRIES = 200000
+
+
+class TagCache(object):
+    # Persistent cache of song records (title, artist, album,
+    # length, bitrate) keyed by path and validated by size+mtime,
+    # so unchanged files do not have to be parsed by mutagen again.
+    #
+    # path: sqlite file (created with parents when missing)
+    # max_entries: entries above this are evicted on flush(),
+    #   least recently used first
+    # refresh: ignore stored entries (all lookups miss)
+    #   and overwrite them with freshly read ones
+    #
+    # Can be used from other threads than the one which created it
+    # (e.g. background loading of streamed playlist).
+    SCHEMA = ('CREATE TABLE IF NOT EXISTS tags ('
+              ' path TEXT PRIMARY KEY,'
+              ' size INTEGER, mtime REAL,'
+              ' title TEXT, artist TEXT, album TEXT,'
+              ' length REAL, bitrate INTEGER,'
+              ' used INTEGER)')
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 refresh=False):
+        self.path = os.path.expanduser(path)
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._used = []
+        self._now = int(time.time())
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(self.path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(self.SCHEMA)
+        self._db.execute('CREATE INDEX IF NOT EXISTS tags_used'
+                         ' ON tags (used)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def get(self, songpath, st):
+        # st: os.stat() result of songpath
+        if self.refresh:
+            self.misses += 1
+            return None
+        with self._lock:
+            row = self._db.execute(
+                'SELECT size, mtime, title, artist, album, length, bitrate'
+                ' FROM tags WHERE path = ?', (songpath,)).fetchone()
+            if (row is None or row[0] != st.st_size or
+                    row[1] != st.st_mtime):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._used.append((self._now, songpath))
+        return tuple(row[2:])
+
+    def put(self, songpath, st, record):
+        # record: (title, artist, album, length, bitrate)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO tags'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (songpath, st.st_size, st.st_mtime) + tuple(record) +
+                (self._now,))
+
+    def flush(self):
+        with self._lock:
+            if self._used:
+                self._db.executemany(
+                    'UPDATE tags SET used = ? WHERE path = ?', self._used)
+                self._used = []
+            self._evict()
+            self._db.commit()
+
+    def close(self):
+        if self._db is None:
+            return
+        self.flush()
+        self._db.close()
+        self._db = None
+
+    def stats(self):
+        return 'tag cache: {hits} hits, {misses} misses'.format(
+            hits=self.hits, misses=self.misses)
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        (count,) = self._db.execute('SELECT COUNT(*) FROM tags').fetchone()
+        if count <= self.max_entries:
+            return
+        self._db.execute(
+            'DELETE FROM tags WHERE path IN ('
+            ' SELECT path FROM tags ORDER BY used ASC LIMIT ?)',
+            (count - self.max_entries,))
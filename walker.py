@@ -0,0 +1,299 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
+import os
+import stat
+import sys
+import threading
+import time
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+SUPPORTED = ('mp3', 'ogg', 'flv', 'flac', 'webm', 'mp4')
+IGNORED = ('.*',)
+BATCH = 100  # songs passed at once from RootScanner's threads
+
+
+class _ListdirEntry(object):
+    # minimal os.DirEntry replacement for pythons without scandir,
+    # costs one stat() per entry (like the old listdir based lookup)
+    def __init__(self, dir_, name):
+        self.name = name
+        self.path = os.path.join(dir_, name)
+        self._mode = None
+
+    def _stat_mode(self):
+        if self._mode is None:
+            try:
+                self._mode = os.stat(self.path).st_mode
+            except OSError:
+                self._mode = 0
+        return self._mode
+
+    def is_dir(self):
+        return stat.S_ISDIR(self._stat_mode())
+
+    def is_file(self):
+        return stat.S_ISREG(self._stat_mode())
+
+
+def _listdir_scan(dir_):
+    return [_ListdirEntry(dir_, name) for name in os.listdir(dir_)]
+
+
+if scandir is None:
+    scandir = _listdir_scan
+
+
+def unicode_path(path):
+    if isinstance(path, bytes):
+        return path.decode('utf-8', 'ignore')
+    return path
+
+
+class SongWalker(object):
+    # Recursive lookup of song files.
+    #
+    # Uses scandir() so file types come from readdir (d_type)
+    # instead of one stat() per entry, and with threads > 1
+    # scans several directories at once (helps on NFS and alike,
+    # where each syscall waits for the server).
+    #
+    # extensions: supported song file extensions (case insensitive)
+    # ignore: fnmatch patterns of entry names to skip (dirs and files),
+    #   defaults to dot-files
+    # threads: number of directories scanned concurrently
+    # progress: callback(dirs, files) called at most once per
+    #   progress_interval seconds and once when finished
+    def __init__(self, extensions=SUPPORTED, ignore=IGNORED, threads=1,
+                 progress=None, progress_interval=0.2):
+        self.extensions = tuple('.' + ext.lower() for ext in extensions)
+        self.ignore = tuple(ignore)
+        self.threads = threads
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.dirs = 0
+        self.files = 0
+        self._last_progress = 0
+
+    def find_songs(self, root, dirs=None):
+        return list(self.iter_songs(root, dirs))
+
+    def iter_songs(self, root, dirs=None):
+        # dirs: list to append paths of scanned directories to
+        self.dirs = 1
+        self.files = 0
+        self._last_progress = 0
+        root = unicode_path(root)
+        if dirs is None:
+            dirs = []  # (not wanted)
+        dirs.append(root)
+        if self.threads < 2:
+            scanned = self._iter_serial(root, dirs)
+        else:
+            scanned = self._iter_threaded(root, dirs)
+        for songs in scanned:
+            self.files += len(songs)
+            self._report()
+            for song in songs:
+                yield song
+        self._report(force=True)
+
+    def _iter_serial(self, root, dirs):
+        todo = [root]
+        for dir_ in todo:
+            subdirs, songs = self.scan_dir(dir_)
+            todo.extend(subdirs)
+            dirs.extend(subdirs)
+            self.dirs += len(subdirs)
+            yield songs
+
+    def _iter_threaded(self, root, dirs):
+        results = Queue()
+        pool = ThreadPool(self.threads)
+        try:
+            pool.apply_async(self._try_scan_dir, (root,),
+                             callback=results.put)
+            pending = 1
+            while pending:
+                result = results.get()
+                pending -= 1
+                if isinstance(result, Exception):
+                    raise result
+                subdirs, songs = result
+                for subdir in subdirs:
+                    pool.apply_async(self._try_scan_dir, (subdir,),
+                                     callback=results.put)
+                pending += len(subdirs)
+                dirs.extend(subdirs)
+                self.dirs += len(subdirs)
+                yield songs
+        finally:
+            pool.terminate()
+
+    def _try_scan_dir(self, dir_):
+        # exceptions are passed back as result,
+        # otherwise the pending scan would never finish
+        try:
+            return self.scan_dir(dir_)
+        except Exception as exc:
+            return exc
+
+    def scan_dir(self, dir_):
+        subdirs = []
+        songs = []
+        try:
+            for entry in scandir(dir_):
+                name = entry.name
+                if self.is_ignored(name):
+                    continue
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                elif (name.lower().endswith(self.extensions) and
+                      entry.is_file()):
+                    songs.append(entry.path)
+        except OSError:
+            # unreadable (or meanwhile removed) directory
+            pass
+        return subdirs, songs
+
+    def is_song(self, name):
+        # by name only (not checking it's a file)
+        return (name.lower().endswith(self.extensions) and
+                not self.is_ignored(name))
+
+    def is_ignored(self, name):
+        for pattern in self.ignore:
+            if fnmatch(name, pattern):
+                return True
+        return False
+
+    def _report(self, force=False):
+        if self.progress is None:
+            return
+        now = time.time()
+        if not force and now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+        self.progress(self.dirs, self.files)
+
+
+def device_of(path):
+    # st_dev of path (same for all paths on one disk/mount)
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+class RootScanner(object):
+    # Scans several roots (collection spread over disks and mounts)
+    # at once, each one in its own thread by its own SongWalker.
+    # Roots on the same device (st_dev) share a limit of concurrently
+    # running scans, so a slow (e.g. NFS) mount does not hold up
+    # the other ones, nor is one disk seeking between many scans.
+    #
+    # make_walker: callable returning new SongWalker (one per root)
+    # per_device: scans running at once on one device
+    # limits: {path: scans} overriding per_device for device of path
+    # progress: callback(roots done, roots, files)
+    def __init__(self, make_walker, per_device=1, limits=None,
+                 progress=None):
+        self._make_walker = make_walker
+        self.per_device = per_device
+        self.limits = {}  # device => scans
+        for (path, scans) in (limits or {}).items():
+            self.limits[device_of(path)] = scans
+        self.progress = progress
+
+    def find_songs(self, roots, dirs=None):
+        # {root: songs found in it}
+        found = dict((root, []) for root in roots)
+        for (root, songs) in self.iter_songs(roots, dirs):
+            found[root].extend(songs)
+        return found
+
+    def iter_songs(self, roots, dirs=None, cancel=None):
+        # yields (root, songs) as they are found, roots interleaved,
+        # dirs: list to append paths of scanned directories to
+        # cancel: threading.Event stopping the scans when set
+        results = Queue()
+        cancel = cancel or threading.Event()
+        semaphores = {}
+        threads = []
+        for root in roots:
+            device = device_of(root)
+            if device not in semaphores:
+                semaphores[device] = threading.Semaphore(
+                    self.limits.get(device, self.per_device))
+            thread = threading.Thread(
+                target=self._scan,
+                args=(root, semaphores[device], results, cancel))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        pending = len(threads)
+        files = 0
+        try:
+            while pending:
+                (root, result) = results.get()
+                if isinstance(result, Exception):
+                    raise result
+                if isinstance(result, tuple):
+                    # (root is done, result are its dirs)
+                    pending -= 1
+                    if dirs is not None:
+                        dirs.extend(result)
+                elif result:
+                    files += len(result)
+                    yield (root, result)
+                if self.progress is not None:
+                    self.progress(len(threads) - pending, len(threads),
+                                  files)
+        finally:
+            cancel.set()
+
+    def _scan(self, root, semaphore, results, cancel):
+        # runs in background thread
+        root_dirs = []
+        with semaphore:
+            try:
+                batch = []
+                for song in self._make_walker().iter_songs(root, root_dirs):
+                    if cancel.is_set():
+                        break
+                    batch.append(song)
+                    if len(batch) >= BATCH:
+                        results.put((root, batch))
+                        batch = []
+                results.put((root, batch))
+            except Exception as exc:
+                results.put((root, exc))
+        results.put((root, tuple(root_dirs)))
+
+
+def print_roots_progress(done, roots, files):
+    print('\rfindings songs: {done}/{roots} roots, {files} files        '
+          .format(done=done, roots=roots, files=files),
+          end='')
+    sys.stdout.flush()
+
+
+def print_progress(dirs, files):
+    print('\rfindings songs: {dirs} dirs, {files} files        '
+          .format(dirs=dirs, files=files),
+          end='')
+    sys.stdout.flush()
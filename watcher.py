@@ -0,0 +1,225 @@
+#! /usr/bin/env python
+# vim: set et sw=4 ts=4 ft=python:
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+
+import walker
+
+
+# changes reported by read_changes(), as (change, path):
+UPDATE = 'update'          # song added (or its file rewritten)
+REMOVE = 'remove'          # song removed
+REMOVE_DIR = 'remove_dir'  # directory removed (with all songs inside)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_ONLYDIR)
+EVENT = struct.Struct('iIII')  # wd, mask, cookie, len (of name)
+
+
+def _encode(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding() or 'utf-8')
+
+
+def _decode(name):
+    return name.rstrip(b'\0').decode('utf-8', 'ignore')
+
+
+def watch(roots, song_walker, poll_interval=30):
+    # inotify watcher (of directory trees of roots) when available,
+    # PollingWatcher otherwise
+    try:
+        return InotifyWatcher(roots, song_walker)
+    except (OSError, AttributeError):
+        return PollingWatcher(roots, song_walker, poll_interval)
+
+
+class InotifyWatcher(object):
+    # Watches directory tree by inotify (through ctypes),
+    # fileno() becomes readable when read_changes() has something.
+    #
+    # song_walker: walker.SongWalker deciding which files are songs
+    #   (and used to look up songs in newly appeared directories)
+    poll_interval = None
+
+    def __init__(self, roots, song_walker):
+        self._walker = song_walker
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}  # watch descriptor => dir path
+        try:
+            for root in roots:
+                self._watch_tree(walker.unicode_path(root))
+        except OSError:
+            self.close()
+            raise
+
+    def fileno(self):
+        return self._fd
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def read_changes(self):
+        changes = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as exc:
+                if exc.errno == errno.EAGAIN:
+                    break
+                raise
+            if not data:
+                break
+            for change in self._parse(data):
+                changes.append(change)
+        return changes
+
+    def _parse(self, data):
+        pos = 0
+        while pos < len(data):
+            (wd, mask, _, length) = EVENT.unpack_from(data, pos)
+            name = _decode(data[pos + EVENT.size:pos + EVENT.size + length])
+            pos += EVENT.size + length
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if mask & IN_Q_OVERFLOW or wd not in self._dirs:
+                # (events got lost, nothing to do about it here)
+                continue
+            path = os.path.join(self._dirs[wd], name)
+            if mask & IN_ISDIR:
+                if self._walker.is_ignored(name):
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._watch_tree(path)
+                    except OSError:
+                        continue
+                    for song in self._walker.iter_songs(path):
+                        yield (UPDATE, song)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    if mask & IN_MOVED_FROM:
+                        self._unwatch_tree(path)
+                    yield (REMOVE_DIR, path)
+            elif self._walker.is_song(name):
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    yield (UPDATE, path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    yield (REMOVE, path)
+
+    def _watch_tree(self, root):
+        dirs = [root]
+        for dir_ in dirs:
+            wd = self._libc.inotify_add_watch(
+                self._fd, _encode(dir_), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err in (errno.ENOENT, errno.ENOTDIR):
+                    continue  # removed meanwhile
+                raise OSError(err, 'inotify_add_watch failed: %s' % (
+                    os.strerror(err)))
+            self._dirs[wd] = dir_
+            (subdirs, _) = self._walker.scan_dir(dir_)
+            dirs.extend(subdirs)
+
+
+    def _unwatch_tree(self, root):
+        # watches follow moved away directory (its inode), events
+        # inside it would come under its old path
+        prefix = os.path.join(root, '')
+        for (wd, dir_) in list(self._dirs.items()):
+            if dir_ == root or dir_.startswith(prefix):
+                del self._dirs[wd]
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+
+class PollingWatcher(object):
+    # Fallback for systems without inotify - read_changes() (to be
+    # called every poll_interval secs) rescans only directories whose
+    # mtime changed. Rewritten files (e.g. changed tags) are not noticed.
+    def __init__(self, roots, song_walker, poll_interval=30):
+        self._walker = song_walker
+        self.poll_interval = poll_interval
+        self._dirs = {}  # dir => (mtime, songs, subdirs)
+        for root in roots:
+            for _ in self._scan_tree(walker.unicode_path(root)):
+                pass
+
+    def fileno(self):
+        return None
+
+    def close(self):
+        pass
+
+    def read_changes(self):
+        changes = []
+        for (dir_, (mtime, songs, subdirs)) in list(self._dirs.items()):
+            if dir_ not in self._dirs:
+                continue  # removed together with its parent
+            try:
+                if os.stat(dir_).st_mtime == mtime:
+                    continue
+            except OSError:
+                continue  # parent will notice
+            (_, new_songs, new_subdirs) = self._scan_dir(dir_)
+            for song in new_songs - songs:
+                changes.append((UPDATE, song))
+            for song in songs - new_songs:
+                changes.append((REMOVE, song))
+            for subdir in subdirs - new_subdirs:
+                self._forget_tree(subdir)
+                changes.append((REMOVE_DIR, subdir))
+            for subdir in new_subdirs - subdirs:
+                for song in self._scan_tree(subdir):
+                    changes.append((UPDATE, song))
+        return changes
+
+    def _scan_dir(self, dir_):
+        try:
+            mtime = os.stat(dir_).st_mtime
+        except OSError:
+            mtime = None
+        (subdirs, songs) = self._walker.scan_dir(dir_)
+        entry = (mtime, set(songs), set(subdirs))
+        self._dirs[dir_] = entry
+        return entry
+
+    def _scan_tree(self, root):
+        # yields songs found
+        dirs = [root]
+        for dir_ in dirs:
+            (_, songs, subdirs) = self._scan_dir(dir_)
+            dirs.extend(subdirs)
+            for song in songs:
+                yield song
+
+    def _forget_tree(self, root):
+        prefix = os.path.join(root, '')
+        for dir_ in list(self._dirs):
+            if dir_ == root or dir_.startswith(prefix):
+                del self._dirs[dir_]